@@ -0,0 +1,51 @@
+import argparse
+import json
+
+from typing import List, Optional, Tuple
+
+# (path in the result, True when a higher value is better)
+KEYS: List[Tuple[str, bool]] = [
+    ("throughput_replies_per_second", True),
+    ("reply_latency_seconds.p50", False),
+    ("reply_latency_seconds.p95", False),
+    ("reply_latency_seconds.p99", False),
+    ("http_calls.nextcloud_per_reply", False),
+    ("http_calls.ollama_per_reply", False),
+    ("generations.wasted", False),
+    ("messages_unanswered", False),
+]
+
+
+def lookup(result: dict, path: str) -> Optional[float]:
+    value = result
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare two loadtest JSON results.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"{'metric':<36}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for path, higher_is_better in KEYS:
+        before, after = lookup(baseline, path), lookup(candidate, path)
+        if before is None or after is None:
+            print(f"{path:<36}{str(before):>12}{str(after):>12}{'':>10}")
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        marker = " !" if worse and abs(change) >= 5 else ""
+        print(f"{path:<36}{before:>12.3f}{after:>12.3f}{change:>+9.1f}%{marker}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def approximate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeOllama:
+
+    def __init__(self,
+                 parallel: int = 2,
+                 prefill_rate: float = 2000.0,
+                 token_rate: float = 40.0,
+                 reply_tokens: int = 60,
+                 load_latency: float = 0.0,
+                 chunk_tokens: int = 4) -> None:
+        # a GPU processes `parallel` requests at once; the rest wait for a slot
+        self.slots: asyncio.Semaphore = asyncio.Semaphore(max(1, parallel))
+        self.prefill_rate: float = prefill_rate
+        self.token_rate: float = token_rate
+        self.reply_tokens: int = reply_tokens
+        self.load_latency: float = load_latency
+        self.chunk_tokens: int = max(1, chunk_tokens)
+        self.calls: Counter = Counter()
+        self.started: int = 0
+        self.completed: int = 0
+        self.aborted: int = 0
+        self.prompt_tokens: int = 0
+        self.eval_tokens: int = 0
+        self.app: web.Application = web.Application()
+        self.app.router.add_post("/api/chat", self.chat)
+        self.app.router.add_post("/api/generate", self.generate)
+        self.app.router.add_get("/api/ps", self.ps)
+        self.runner: Optional[web.AppRunner] = None
+        self.url: str = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        # cancel handlers on disconnect, so aborted generations free their slot like in Ollama
+        self.runner = web.AppRunner(self.app, access_log=None, handler_cancellation=True)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.url = f"http://{host}:{self.runner.addresses[0][1]}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def ps(self, request: web.Request) -> web.Response:
+        self.calls["GET /api/ps"] += 1
+        return web.json_response({"models": []})
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        self.calls["POST /api/chat"] += 1
+        body = await request.json()
+        prompt = "".join(message.get("content") or "" for message in body.get("messages", []))
+        return await self._run(request, body, approximate_tokens(prompt), chat=True)
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        self.calls["POST /api/generate"] += 1
+        body = await request.json()
+        if not body.get("prompt"):
+            # like Ollama, a request without a prompt only loads the model and is not a generation
+            return web.json_response(self._chunk(body, "", chat=False, done=True) | {"done_reason": "load"})
+        return await self._run(request, body, approximate_tokens(body.get("prompt") or ""), chat=False)
+
+    def _chunk(self, body: dict, text: str, chat: bool, done: bool = False, **stats) -> dict:
+        chunk = {
+            "model": body.get("model", "bench"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "done": done,
+        }
+        if chat:
+            chunk["message"] = {"role": "assistant", "content": text}
+        else:
+            chunk["response"] = text
+        if done:
+            chunk["done_reason"] = "stop"
+            chunk.update(stats)
+        return chunk
+
+    async def _run(self, request: web.Request, body: dict, prompt_tokens: int, chat: bool) -> web.StreamResponse:
+        stream = body.get("stream", True)
+        started = time.monotonic()
+        self.started += 1
+        try:
+            async with self.slots:
+                queued = time.monotonic()
+                await asyncio.sleep(self.load_latency + prompt_tokens / self.prefill_rate)
+                prefilled = time.monotonic()
+                self.prompt_tokens += prompt_tokens
+
+                response: Optional[web.StreamResponse] = None
+                if stream:
+                    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+                    await response.prepare(request)
+                text = []
+                for produced in range(0, self.reply_tokens, self.chunk_tokens):
+                    count = min(self.chunk_tokens, self.reply_tokens - produced)
+                    await asyncio.sleep(count / self.token_rate)
+                    piece = "".join(f"word{produced + index} " for index in range(count))
+                    text.append(piece)
+                    if response is not None:
+                        await response.write((json.dumps(self._chunk(body, piece, chat)) + "\n").encode())
+                self.eval_tokens += self.reply_tokens
+                finished = time.monotonic()
+                stats = {
+                    "total_duration": int((finished - started) * 1e9),
+                    "load_duration": int((prefilled - queued) * 1e9),
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int((prefilled - queued) * 1e9),
+                    "eval_count": self.reply_tokens,
+                    "eval_duration": int((finished - prefilled) * 1e9),
+                }
+                if response is not None:
+                    await response.write((json.dumps(self._chunk(body, "", chat, done=True, **stats)) + "\n").encode())
+                    await response.write_eof()
+                    self.completed += 1
+                    return response
+                self.completed += 1
+                return web.json_response(self._chunk(body, "".join(text).strip(), chat, done=True, **stats))
+        except (asyncio.CancelledError, ConnectionResetError):
+            self.aborted += 1
+            raise
@@ -0,0 +1,243 @@
+import asyncio
+import itertools
+import random
+import time
+
+from aiohttp import web
+from collections import Counter
+from typing import Dict, List, Optional
+
+SPREED: str = "/ocs/v2.php/apps/spreed"
+NOT_MODIFIED: int = 304
+
+
+def ocs(data, status: int = 200, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    return web.json_response(
+        {"ocs": {"meta": {"status": "ok", "statuscode": status, "message": "OK"}, "data": data}},
+        headers=headers)
+
+
+class FakeRoom:
+
+    def __init__(self, room_id: int, token: str, user: str, bot_user: str) -> None:
+        self.room_id: int = room_id
+        self.token: str = token
+        self.user: str = user
+        self.bot_user: str = bot_user
+        self.messages: List[dict] = []
+        self.last_read: int = 0
+        self.last_activity: int = int(time.time())
+        # monotonic send times of user messages that have not been answered yet
+        self.awaiting: List[float] = []
+
+    @property
+    def unread(self) -> int:
+        return sum(1 for message in self.messages
+                   if message["id"] > self.last_read and message["actorId"] != self.bot_user)
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.room_id,
+            "token": self.token,
+            "type": 1,
+            "name": self.user,
+            "displayName": self.user,
+            "participantType": 3,
+            "attendeeId": self.room_id,
+            "attendeePin": "",
+            "actorType": "users",
+            "actorId": self.bot_user,
+            "permissions": 254,
+            "attendeePermissions": 0,
+            "callPermissions": 0,
+            "defaultPermissions": 0,
+            "hasPassword": False,
+            "hasCall": False,
+            "lastActivity": self.last_activity,
+            "isFavorite": False,
+            "notificationLevel": 1,
+            "lobbyState": 0,
+            "lobbyTimer": 0,
+            "sipEnabled": 0,
+            "canEnableSIP": False,
+            "unreadMessages": self.unread,
+            "unreadMention": False,
+            "unreadMentionDirect": False,
+            "lastReadMessage": self.last_read,
+            "lastCommonReadMessage": self.last_read,
+            "lastMessage": self.messages[-1] if self.messages else [],
+            "avatarVersion": "",
+            "callStartTime": 0,
+        }
+
+
+class FakeTalk:
+
+    def __init__(self, bot_user: str = "talkbot", latency: float = 0.0, jitter: float = 0.0) -> None:
+        self.bot_user: str = bot_user
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.rooms: Dict[str, FakeRoom] = {}
+        self.calls: Counter = Counter()
+        self.reply_latencies: List[float] = []
+        self.replies: int = 0
+        self.edits: int = 0
+        self.user_messages: int = 0
+        self._ids = itertools.count(1)
+        self.app: web.Application = web.Application(middlewares=[self._delay])
+        self.app.router.add_get("/ocs/v1.php/cloud/capabilities", self.capabilities)
+        self.app.router.add_get("/ocs/v1.php/cloud/user", self.current_user)
+        self.app.router.add_get(SPREED + "/api/v4/room", self.list_rooms)
+        self.app.router.add_get(SPREED + "/api/v1/chat/{token}", self.receive)
+        self.app.router.add_post(SPREED + "/api/v1/chat/{token}", self.send)
+        self.app.router.add_put(SPREED + "/api/v1/chat/{token}/{message_id}", self.edit)
+        self.app.router.add_post(SPREED + "/api/v1/reaction/{token}/{message_id}", self.react)
+        self.app.router.add_delete(SPREED + "/api/v1/reaction/{token}/{message_id}", self.unreact)
+        self.runner: Optional[web.AppRunner] = None
+        self.url: str = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.url = f"http://{host}:{self.runner.addresses[0][1]}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    @web.middleware
+    async def _delay(self, request: web.Request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else "unmatched"
+        self.calls[f"{request.method} {route.replace(SPREED, '')}"] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        return await handler(request)
+
+    # ----------------------------
+    # Simulated users
+    # ----------------------------
+
+    def add_user(self, user: str) -> FakeRoom:
+        room_id = len(self.rooms) + 1
+        room = FakeRoom(room_id, f"room{room_id}", user, self.bot_user)
+        self.rooms[room.token] = room
+        return room
+
+    def post_user_message(self, room: FakeRoom, text: str) -> dict:
+        self.user_messages += 1
+        room.awaiting.append(time.monotonic())
+        return self._append(room, room.user, text)
+
+    def _append(self, room: FakeRoom, actor: str, text: str) -> dict:
+        message = {
+            "id": next(self._ids),
+            "token": room.token,
+            "actorType": "users",
+            "actorId": actor,
+            "actorDisplayName": actor,
+            "timestamp": int(time.time()),
+            "systemMessage": "",
+            "messageType": "comment",
+            "isReplyable": True,
+            "referenceId": "",
+            "message": text,
+            "messageParameters": {},
+            "expirationTimestamp": 0,
+            "reactions": {},
+            "reactionsSelf": [],
+            "markdown": True,
+        }
+        room.messages.append(message)
+        room.last_activity = message["timestamp"]
+        return message
+
+    def _room(self, request: web.Request) -> FakeRoom:
+        room = self.rooms.get(request.match_info["token"])
+        if room is None:
+            raise web.HTTPNotFound()
+        return room
+
+    def _message(self, room: FakeRoom, request: web.Request) -> dict:
+        message_id = int(request.match_info["message_id"])
+        for message in room.messages:
+            if message["id"] == message_id:
+                return message
+        raise web.HTTPNotFound()
+
+    # ----------------------------
+    # OCS endpoints
+    # ----------------------------
+
+    async def capabilities(self, request: web.Request) -> web.Response:
+        return ocs({
+            "version": {"major": 30, "minor": 0, "micro": 0, "string": "30.0.0", "extendedSupport": False},
+            "capabilities": {"spreed": {"features": ["chat-v2", "reactions", "edit-messages", "bots-v1"], "config": {}}},
+        })
+
+    async def current_user(self, request: web.Request) -> web.Response:
+        return ocs({"id": self.bot_user})
+
+    async def list_rooms(self, request: web.Request) -> web.Response:
+        since = int(request.query.get("modifiedSince", 0))
+        rooms = [room.to_json() for room in self.rooms.values() if room.last_activity >= since]
+        return ocs(rooms, headers={
+            "X-Nextcloud-Talk-Modified-Before": str(int(time.time())),
+            "X-Nextcloud-Talk-Hash": "bench",
+        })
+
+    async def receive(self, request: web.Request) -> web.Response:
+        room = self._room(request)
+        limit = min(int(request.query.get("limit", 100)), 200)
+        if request.query.get("lookIntoFuture", "0") == "1":
+            last_known = int(request.query.get("lastKnownMessageId", 0))
+            newer = [message for message in room.messages if message["id"] > last_known][:limit]
+            if not newer:
+                return web.Response(status=NOT_MODIFIED)
+            if request.query.get("setReadMarker", "1") == "1":
+                room.last_read = max(room.last_read, newer[-1]["id"])
+            return ocs(newer)
+        # history comes newest first, like Talk does
+        return ocs(list(reversed(room.messages[-limit:])))
+
+    async def send(self, request: web.Request) -> web.Response:
+        room = self._room(request)
+        body = await request.json()
+        message = self._append(room, self.bot_user, body["message"])
+        # posting marks everything up to the own message as read
+        room.last_read = message["id"]
+        self.replies += 1
+        now = time.monotonic()
+        self.reply_latencies.extend(now - sent_at for sent_at in room.awaiting)
+        room.awaiting.clear()
+        return ocs(message, status=201)
+
+    async def edit(self, request: web.Request) -> web.Response:
+        room = self._room(request)
+        message = self._message(room, request)
+        message["message"] = (await request.json())["message"]
+        self.edits += 1
+        return ocs(message)
+
+    async def react(self, request: web.Request) -> web.Response:
+        room = self._room(request)
+        message = self._message(room, request)
+        reaction = request.query["reaction"]
+        if reaction not in message["reactionsSelf"]:
+            message["reactionsSelf"].append(reaction)
+            message["reactions"][reaction] = message["reactions"].get(reaction, 0) + 1
+        return ocs({}, status=201)
+
+    async def unreact(self, request: web.Request) -> web.Response:
+        room = self._room(request)
+        message = self._message(room, request)
+        reaction = request.query["reaction"]
+        if reaction not in message["reactionsSelf"]:
+            raise web.HTTPNotFound()
+        message["reactionsSelf"].remove(reaction)
+        message["reactions"][reaction] -= 1
+        if not message["reactions"][reaction]:
+            del message["reactions"][reaction]
+        return ocs({})
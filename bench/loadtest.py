@@ -0,0 +1,181 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Dict, List, Optional
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_ollama import FakeOllama  # noqa: E402
+from bench.fake_talk import FakeTalk  # noqa: E402
+
+BOT_USER: str = "talkbot"
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_bot(talk_url: str, ollama_url: str, args: argparse.Namespace) -> None:
+    # Config is a singleton read at import time, so the environment must be complete before talkbot is imported
+    env = {
+        "NEXTCLOUD_URL": talk_url,
+        "NEXTCLOUD_USERNAME": BOT_USER,
+        "NEXTCLOUD_PASSWORD": "bench",
+        "OLLAMA_HOST": ollama_url,
+        "OLLAMA_MODEL": "bench",
+        "OLLAMA_SYSTEM_PROMPT": "You are a benchmark.",
+        "OLLAMA_ACTOR_ID": BOT_USER,
+        "OLLAMA_STREAM": "1" if args.stream else "0",
+        "STATE_PATH": os.path.join(tempfile.mkdtemp(prefix="talkbot-bench-"), "state.db") if args.state else "",
+        "LOG_DIRECTORY": tempfile.mkdtemp(prefix="talkbot-bench-logs-"),
+        "LOG_LEVEL": args.log_level,
+    }
+    for override in args.env:
+        key, _, value = override.partition("=")
+        env[key] = value
+    os.environ.update(env)
+
+
+async def send_load(talk: FakeTalk, rooms: list, args: argparse.Namespace, rng: random.Random) -> None:
+    # open loop: Poisson arrivals over all users, independent of how fast the bot answers
+    deadline = time.monotonic() + args.duration
+    sequence = 0
+    while time.monotonic() < deadline:
+        await asyncio.sleep(rng.expovariate(args.rate))
+        sequence += 1
+        room = rng.choice(rooms)
+        talk.post_user_message(room, f"Question {sequence} from {room.user}: " + "lorem ipsum " * args.message_words)
+
+
+async def wait_for_replies(talk: FakeTalk, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and any(room.awaiting for room in talk.rooms.values()):
+        await asyncio.sleep(0.1)
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    rng = random.Random(args.seed)
+    talk = FakeTalk(bot_user=BOT_USER, latency=args.nextcloud_latency, jitter=args.nextcloud_jitter)
+    ollama = FakeOllama(parallel=args.ollama_parallel,
+                        prefill_rate=args.prefill_rate,
+                        token_rate=args.token_rate,
+                        reply_tokens=args.reply_tokens,
+                        load_latency=args.load_latency)
+    talk_url = await talk.start()
+    ollama_url = await ollama.start()
+    rooms = [talk.add_user(f"user{index}") for index in range(args.users)]
+
+    configure_bot(talk_url, ollama_url, args)
+    from talkbot import TalkBot
+
+    bot = TalkBot()
+    monitor = asyncio.create_task(bot.monitor_and_reply(bot.check_interval))
+    started = time.monotonic()
+    try:
+        await send_load(talk, rooms, args, rng)
+        await wait_for_replies(talk, args.drain)
+    finally:
+        elapsed = time.monotonic() - started
+        bot.request_shutdown()
+        await asyncio.gather(monitor, return_exceptions=True)
+        await bot.shutdown()
+        await talk.stop()
+        await ollama.stop()
+
+    latencies = talk.reply_latencies
+    nextcloud_calls = sum(talk.calls.values())
+    ollama_calls = sum(count for call, count in ollama.calls.items() if call != "GET /api/ps")
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "scenario": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed_seconds": elapsed,
+        "messages_sent": talk.user_messages,
+        "messages_answered": len(latencies),
+        "messages_unanswered": sum(len(room.awaiting) for room in talk.rooms.values()),
+        "replies": talk.replies,
+        "edits": talk.edits,
+        "throughput_replies_per_second": talk.replies / elapsed if elapsed else 0.0,
+        "reply_latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "max": max(latencies) if latencies else None,
+        },
+        "http_calls": {
+            "nextcloud": dict(talk.calls),
+            "ollama": dict(ollama.calls),
+            "nextcloud_per_reply": nextcloud_calls / talk.replies if talk.replies else None,
+            "ollama_per_reply": ollama_calls / talk.replies if talk.replies else None,
+        },
+        "generations": {
+            "started": ollama.started,
+            "completed": ollama.completed,
+            "aborted": ollama.aborted,
+            # generations that never turned into a complete reply: superseded, discarded or failed;
+            # a cancelled stream may already have posted a partial message (marked superseded), so aborts are counted on their own
+            "wasted": max(ollama.aborted, ollama.started - talk.replies),
+            "prompt_tokens": ollama.prompt_tokens,
+            "eval_tokens": ollama.eval_tokens,
+        },
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Drive TalkBot against fake Talk and Ollama servers.")
+    parser.add_argument("--users", type=int, default=20, help="simulated one-to-one conversations")
+    parser.add_argument("--rate", type=float, default=2.0, help="user messages per second over all users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds messages are sent for")
+    parser.add_argument("--drain", type=float, default=60.0, help="seconds to wait for outstanding replies")
+    parser.add_argument("--message-words", type=int, default=10, help="filler words per user message")
+    parser.add_argument("--nextcloud-latency", type=float, default=0.02, help="added latency per Talk request")
+    parser.add_argument("--nextcloud-jitter", type=float, default=0.01, help="random spread of the Talk latency")
+    parser.add_argument("--ollama-parallel", type=int, default=2, help="generations the fake GPU runs at once")
+    parser.add_argument("--prefill-rate", type=float, default=2000.0, help="prompt tokens evaluated per second")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="generated tokens per second")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="tokens per generated reply")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="fixed latency before each generation")
+    parser.add_argument("--stream", action="store_true", help="run the bot with OLLAMA_STREAM=1")
+    parser.add_argument("--state", action="store_true", help="enable the SQLite state store in a temp dir")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra bot configuration, may be repeated")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="write the JSON result here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -74,6 +74,60 @@ class Config:
         self.NEXTCLOUD_BACKOFF: float = get_env_or_cfg(
             "NEXTCLOUD", "backoff", "NEXTCLOUD_BACKOFF", default=1.2, cast=float
         )
+        self.NEXTCLOUD_MIN_CHECK_INTERVAL: float = get_env_or_cfg(
+            "NEXTCLOUD", "min_check_interval", "NEXTCLOUD_MIN_CHECK_INTERVAL", default=1.0, cast=float
+        )
+        self.NEXTCLOUD_MAX_CHECK_INTERVAL: float = get_env_or_cfg(
+            "NEXTCLOUD", "max_check_interval", "NEXTCLOUD_MAX_CHECK_INTERVAL", default=60.0, cast=float
+        )
+        self.NEXTCLOUD_IDLE_BACKOFF: float = get_env_or_cfg(
+            "NEXTCLOUD", "idle_backoff", "NEXTCLOUD_IDLE_BACKOFF", default=1.5, cast=float
+        )
+        self.NEXTCLOUD_CHECK_JITTER: float = get_env_or_cfg(
+            "NEXTCLOUD", "check_jitter", "NEXTCLOUD_CHECK_JITTER", default=0.1, cast=float
+        )
+        self.NEXTCLOUD_IO_WORKERS: int = get_env_or_cfg(
+            "NEXTCLOUD", "io_workers", "NEXTCLOUD_IO_WORKERS", default=8, cast=int
+        )
+        self.NEXTCLOUD_QUEUE_LIMIT: int = get_env_or_cfg(
+            "NEXTCLOUD", "queue_limit", "NEXTCLOUD_QUEUE_LIMIT", default=500, cast=int
+        )
+        self.NEXTCLOUD_SHUTDOWN_TIMEOUT: float = get_env_or_cfg(
+            "NEXTCLOUD", "shutdown_timeout", "NEXTCLOUD_SHUTDOWN_TIMEOUT", default=25.0, cast=float
+        )
+        self.NEXTCLOUD_HISTORY_LIMIT: int = get_env_or_cfg(
+            "NEXTCLOUD", "history_limit", "NEXTCLOUD_HISTORY_LIMIT", default=200, cast=int
+        )
+        self.NEXTCLOUD_MESSAGE_CACHE_SIZE: int = get_env_or_cfg(
+            "NEXTCLOUD", "message_cache_size", "NEXTCLOUD_MESSAGE_CACHE_SIZE", default=500, cast=int
+        )
+        self.NEXTCLOUD_REACTION_WINDOW: float = get_env_or_cfg(
+            "NEXTCLOUD", "reaction_window", "NEXTCLOUD_REACTION_WINDOW", default=1.0, cast=float
+        )
+        self.NEXTCLOUD_SETTLE_WINDOW: float = get_env_or_cfg(
+            "NEXTCLOUD", "settle_window", "NEXTCLOUD_SETTLE_WINDOW", default=1.5, cast=float
+        )
+        self.NEXTCLOUD_CONVERSATION_TTL: float = get_env_or_cfg(
+            "NEXTCLOUD", "conversation_ttl", "NEXTCLOUD_CONVERSATION_TTL", default=10.0, cast=float
+        )
+        self.NEXTCLOUD_CONVERSATION_FULL_REFRESH: float = get_env_or_cfg(
+            "NEXTCLOUD", "conversation_full_refresh", "NEXTCLOUD_CONVERSATION_FULL_REFRESH", default=600.0, cast=float
+        )
+        self.NEXTCLOUD_RATE_LIMIT: float = get_env_or_cfg(
+            "NEXTCLOUD", "rate_limit", "NEXTCLOUD_RATE_LIMIT", default=10.0, cast=float
+        )
+        self.NEXTCLOUD_RATE_BURST: float = get_env_or_cfg(
+            "NEXTCLOUD", "rate_burst", "NEXTCLOUD_RATE_BURST", default=20.0, cast=float
+        )
+        self.NEXTCLOUD_BREAKER_THRESHOLD: int = get_env_or_cfg(
+            "NEXTCLOUD", "breaker_threshold", "NEXTCLOUD_BREAKER_THRESHOLD", default=5, cast=int
+        )
+        self.NEXTCLOUD_BREAKER_COOLDOWN: float = get_env_or_cfg(
+            "NEXTCLOUD", "breaker_cooldown", "NEXTCLOUD_BREAKER_COOLDOWN", default=30.0, cast=float
+        )
+        self.NEXTCLOUD_RETRY_BUDGET: float = get_env_or_cfg(
+            "NEXTCLOUD", "retry_budget", "NEXTCLOUD_RETRY_BUDGET", default=0.2, cast=float
+        )
 
         # ----------------------------
         # Ollama
@@ -81,6 +135,30 @@ class Config:
         self.OLLAMA_HOST: str = get_env_or_cfg(
             "OLLAMA", "host", "OLLAMA_HOST", required=True, cast=str
         )
+        self.OLLAMA_BACKENDS: str = get_env_or_cfg(
+            "OLLAMA", "backends", "OLLAMA_BACKENDS", default="", cast=str
+        )
+        self.OLLAMA_BACKEND_CONCURRENCY: int = get_env_or_cfg(
+            "OLLAMA", "backend_concurrency", "OLLAMA_BACKEND_CONCURRENCY", default=4, cast=int
+        )
+        self.OLLAMA_TIMEOUT: float = get_env_or_cfg(
+            "OLLAMA", "timeout", "OLLAMA_TIMEOUT", default=600.0, cast=float
+        )
+        self.OLLAMA_MAX_PARALLEL: int = get_env_or_cfg(
+            "OLLAMA", "max_parallel", "OLLAMA_MAX_PARALLEL", default=0, cast=int
+        )
+        self.OLLAMA_PRIORITY: str = get_env_or_cfg(
+            "OLLAMA", "priority", "OLLAMA_PRIORITY", default="shortest", cast=str
+        )
+        self.OLLAMA_PRIORITY_AGING: float = get_env_or_cfg(
+            "OLLAMA", "priority_aging", "OLLAMA_PRIORITY_AGING", default=50.0, cast=float
+        )
+        self.OLLAMA_HEALTH_INTERVAL: float = get_env_or_cfg(
+            "OLLAMA", "health_interval", "OLLAMA_HEALTH_INTERVAL", default=15.0, cast=float
+        )
+        self.OLLAMA_EJECT_SECONDS: float = get_env_or_cfg(
+            "OLLAMA", "eject_seconds", "OLLAMA_EJECT_SECONDS", default=30.0, cast=float
+        )
         self.OLLAMA_MODEL: str = get_env_or_cfg(
             "OLLAMA", "model", "OLLAMA_MODEL", required=True, cast=str
         )
@@ -90,6 +168,172 @@ class Config:
         self.OLLAMA_ACTOR_ID: str = get_env_or_cfg(
             "OLLAMA", "actor_id", "OLLAMA_ACTOR_ID", required=True, cast=str
         )
+        self.OLLAMA_CONTEXT_TOKENS: int = get_env_or_cfg(
+            "OLLAMA", "context_tokens", "OLLAMA_CONTEXT_TOKENS", default=4096, cast=int
+        )
+        self.OLLAMA_CONTEXT_METADATA: str = get_env_or_cfg(
+            "OLLAMA", "context_metadata", "OLLAMA_CONTEXT_METADATA", default="compact", cast=str
+        )
+        self.OLLAMA_STABLE_PREFIX: int = get_env_or_cfg(
+            "OLLAMA", "stable_prefix", "OLLAMA_STABLE_PREFIX", default=1, cast=int
+        )
+        self.OLLAMA_KEEP_ALIVE: str = get_env_or_cfg(
+            "OLLAMA", "keep_alive", "OLLAMA_KEEP_ALIVE", default="30m", cast=str
+        )
+        self.OLLAMA_PRELOAD: int = get_env_or_cfg(
+            "OLLAMA", "preload", "OLLAMA_PRELOAD", default=1, cast=int
+        )
+        self.OLLAMA_NUM_CTX: int = get_env_or_cfg(
+            "OLLAMA", "num_ctx", "OLLAMA_NUM_CTX", default=0, cast=int
+        )
+        self.OLLAMA_STREAM: int = get_env_or_cfg(
+            "OLLAMA", "stream", "OLLAMA_STREAM", default=0, cast=int
+        )
+        self.OLLAMA_STREAM_FIRST_CHARS: int = get_env_or_cfg(
+            "OLLAMA", "stream_first_chars", "OLLAMA_STREAM_FIRST_CHARS", default=40, cast=int
+        )
+        self.OLLAMA_STREAM_FIRST_DELAY: float = get_env_or_cfg(
+            "OLLAMA", "stream_first_delay", "OLLAMA_STREAM_FIRST_DELAY", default=1.0, cast=float
+        )
+        self.OLLAMA_STREAM_EDIT_INTERVAL: float = get_env_or_cfg(
+            "OLLAMA", "stream_edit_interval", "OLLAMA_STREAM_EDIT_INTERVAL", default=2.0, cast=float
+        )
+
+        # ----------------------------
+        # HTTP
+        # ----------------------------
+        self.HTTP_HTTP2: int = get_env_or_cfg(
+            "HTTP", "http2", "HTTP_HTTP2", default=0, cast=int
+        )
+        self.HTTP_MAX_CONNECTIONS: int = get_env_or_cfg(
+            "HTTP", "max_connections", "HTTP_MAX_CONNECTIONS", default=20, cast=int
+        )
+        self.HTTP_MAX_KEEPALIVE: int = get_env_or_cfg(
+            "HTTP", "max_keepalive", "HTTP_MAX_KEEPALIVE", default=10, cast=int
+        )
+        self.HTTP_KEEPALIVE_EXPIRY: float = get_env_or_cfg(
+            "HTTP", "keepalive_expiry", "HTTP_KEEPALIVE_EXPIRY", default=60.0, cast=float
+        )
+        self.HTTP_CONNECT_TIMEOUT: float = get_env_or_cfg(
+            "HTTP", "connect_timeout", "HTTP_CONNECT_TIMEOUT", default=5.0, cast=float
+        )
+        self.HTTP_READ_TIMEOUT: float = get_env_or_cfg(
+            "HTTP", "read_timeout", "HTTP_READ_TIMEOUT", default=10.0, cast=float
+        )
+        self.HTTP_VERIFY_SSL: int = get_env_or_cfg(
+            "HTTP", "verify_ssl", "HTTP_VERIFY_SSL", default=0, cast=int
+        )
+
+        # ----------------------------
+        # Webhook
+        # ----------------------------
+        self.WEBHOOK_ENABLED: int = get_env_or_cfg(
+            "WEBHOOK", "enabled", "WEBHOOK_ENABLED", default=0, cast=int
+        )
+        self.WEBHOOK_SECRET: str = get_env_or_cfg(
+            "WEBHOOK", "secret", "WEBHOOK_SECRET", required=bool(self.WEBHOOK_ENABLED), cast=str
+        )
+        self.WEBHOOK_HOST: str = get_env_or_cfg(
+            "WEBHOOK", "host", "WEBHOOK_HOST", default="0.0.0.0", cast=str
+        )
+        self.WEBHOOK_PORT: int = get_env_or_cfg(
+            "WEBHOOK", "port", "WEBHOOK_PORT", default=8080, cast=int
+        )
+        self.WEBHOOK_PATH: str = get_env_or_cfg(
+            "WEBHOOK", "path", "WEBHOOK_PATH", default="/webhook", cast=str
+        )
+        self.WEBHOOK_FALLBACK_INTERVAL: int = get_env_or_cfg(
+            "WEBHOOK", "fallback_interval", "WEBHOOK_FALLBACK_INTERVAL", default=60, cast=int
+        )
+
+        # ----------------------------
+        # Group conversations
+        # ----------------------------
+        self.GROUP_ENABLED: int = get_env_or_cfg(
+            "GROUP", "enabled", "GROUP_ENABLED", default=0, cast=int
+        )
+        self.GROUP_KEYWORDS: str = get_env_or_cfg(
+            "GROUP", "keywords", "GROUP_KEYWORDS", default="", cast=str
+        )
+        self.GROUP_WINDOW: int = get_env_or_cfg(
+            "GROUP", "window", "GROUP_WINDOW", default=30, cast=int
+        )
+
+        # ----------------------------
+        # Response cache
+        # ----------------------------
+        self.RESPONSE_CACHE_ENABLED: int = get_env_or_cfg(
+            "RESPONSE_CACHE", "enabled", "RESPONSE_CACHE_ENABLED", default=0, cast=int
+        )
+        self.RESPONSE_CACHE_SIZE: int = get_env_or_cfg(
+            "RESPONSE_CACHE", "size", "RESPONSE_CACHE_SIZE", default=1000, cast=int
+        )
+        self.RESPONSE_CACHE_TTL: float = get_env_or_cfg(
+            "RESPONSE_CACHE", "ttl", "RESPONSE_CACHE_TTL", default=86400.0, cast=float
+        )
+        self.RESPONSE_CACHE_MESSAGES: int = get_env_or_cfg(
+            "RESPONSE_CACHE", "messages", "RESPONSE_CACHE_MESSAGES", default=1, cast=int
+        )
+        self.RESPONSE_CACHE_PATH: str = get_env_or_cfg(
+            "RESPONSE_CACHE", "path", "RESPONSE_CACHE_PATH", default="", cast=str
+        )
+        self.RESPONSE_CACHE_EXCLUDE: str = get_env_or_cfg(
+            "RESPONSE_CACHE", "exclude", "RESPONSE_CACHE_EXCLUDE", default="", cast=str
+        )
+
+        # ----------------------------
+        # Metrics
+        # ----------------------------
+        self.METRICS_ENABLED: int = get_env_or_cfg(
+            "METRICS", "enabled", "METRICS_ENABLED", default=0, cast=int
+        )
+        self.METRICS_HOST: str = get_env_or_cfg(
+            "METRICS", "host", "METRICS_HOST", default="127.0.0.1", cast=str
+        )
+        self.METRICS_PORT: int = get_env_or_cfg(
+            "METRICS", "port", "METRICS_PORT", default=9100, cast=int
+        )
+        self.METRICS_PATH: str = get_env_or_cfg(
+            "METRICS", "path", "METRICS_PATH", default="/metrics", cast=str
+        )
+
+        # ----------------------------
+        # Sharding
+        # ----------------------------
+        self.SHARD_ENABLED: int = get_env_or_cfg(
+            "SHARD", "enabled", "SHARD_ENABLED", default=0, cast=int
+        )
+        self.SHARD_ID: str = get_env_or_cfg(
+            "SHARD", "id", "SHARD_ID", default="", cast=str
+        )
+        self.SHARD_MEMBERS: str = get_env_or_cfg(
+            "SHARD", "members", "SHARD_MEMBERS", default="", cast=str
+        )
+        self.SHARD_BACKEND: str = get_env_or_cfg(
+            "SHARD", "backend", "SHARD_BACKEND", default="sqlite", cast=str
+        )
+        self.SHARD_LEASE_PATH: str = get_env_or_cfg(
+            "SHARD", "lease_path", "SHARD_LEASE_PATH", default="./data/shards.db", cast=str
+        )
+        self.SHARD_LEASE_TTL: float = get_env_or_cfg(
+            "SHARD", "lease_ttl", "SHARD_LEASE_TTL", default=15.0, cast=float
+        )
+        self.SHARD_HEARTBEAT: float = get_env_or_cfg(
+            "SHARD", "heartbeat", "SHARD_HEARTBEAT", default=5.0, cast=float
+        )
+
+        # ----------------------------
+        # State
+        # ----------------------------
+        self.STATE_PATH: str = get_env_or_cfg(
+            "STATE", "path", "STATE_PATH", default="./data/talkbot_state.db", cast=str
+        )
+        self.STATE_FLUSH_INTERVAL: float = get_env_or_cfg(
+            "STATE", "flush_interval", "STATE_FLUSH_INTERVAL", default=5.0, cast=float
+        )
+        self.STATE_FRAGMENT_LIMIT: int = get_env_or_cfg(
+            "STATE", "fragment_limit", "STATE_FRAGMENT_LIMIT", default=5000, cast=int
+        )
 
         # ----------------------------
         # Logging
@@ -122,5 +366,14 @@ class Config:
         self.DATE_FORMAT: str = get_env_or_cfg(
             "LOGGING", "DATE_FORMAT", "DATE_FORMAT", default="%Y-%m-%d %H:%M:%S", cast=str
         )
+        self.LOG_ASYNC: int = get_env_or_cfg(
+            "LOGGING", "LOG_ASYNC", "LOG_ASYNC", default=1, cast=int
+        )
+        self.LOG_QUEUE_SIZE: int = get_env_or_cfg(
+            "LOGGING", "LOG_QUEUE_SIZE", "LOG_QUEUE_SIZE", default=10000, cast=int
+        )
+        self.LOG_SAMPLE_INTERVAL: float = get_env_or_cfg(
+            "LOGGING", "LOG_SAMPLE_INTERVAL", "LOG_SAMPLE_INTERVAL", default=60.0, cast=float
+        )
 
         self.initialized = True
\ No newline at end of file
@@ -8,6 +8,8 @@ REACTIONS:dict={
     "DELETE":"" 
 }
 
+SUPERSEDED_MARKER:str="(superseded by a newer message)"
+
 USELESS_MESSAGES:list=[
     "you deleted a message",
     "reaction deleted by author",
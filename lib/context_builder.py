@@ -0,0 +1,129 @@
+import hashlib
+import math
+import re
+
+from collections import OrderedDict
+from nc_py_api.talk import TalkMessage
+from ollama import Message
+from typing import Hashable, List, Optional, Tuple
+from lib.utils import Mappers
+from lib.state_store import StateStore
+
+_WORD = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def approximate_tokens(text: str) -> int:
+    # BPE vocabularies land between ~4 characters and ~1.3 words per token for chat text;
+    # taking the larger of the two keeps the estimate on the safe side for code and non-latin scripts
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / 4), math.ceil(len(_WORD.findall(text)) * 1.3))
+
+
+class ContextReport:
+
+    def __init__(self, budget: int) -> None:
+        self.budget: int = budget
+        self.tokens: int = 0
+        self.included: int = 0
+        self.dropped: int = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self.dropped > 0
+
+    def __repr__(self) -> str:
+        return (f"<ContextReport included={self.included}, dropped={self.dropped}, "
+                f"tokens={self.tokens}/{self.budget}>")
+
+
+class ContextBuilder:
+
+    def __init__(self,
+                 assistant_id: str,
+                 budget: int = 4096,
+                 metadata: str = "compact",
+                 stable_prefix: bool = True,
+                 headroom: float = 0.75,
+                 cache_size: int = 20000,
+                 max_anchors: int = 1000,
+                 state: Optional[StateStore] = None):
+        self.assistant_id: str = assistant_id
+        self.budget: int = budget
+        self.metadata: str = metadata
+        self.stable_prefix: bool = stable_prefix
+        self.headroom: float = headroom
+        self.cache_size: int = cache_size
+        self.max_anchors: int = max_anchors
+        self.mappers: Mappers = Mappers()
+        # rendered once per message, so already-sent history stays byte-identical across turns
+        self._render_cache: "OrderedDict[Hashable, Tuple[Message, int]]" = OrderedDict()
+        # oldest message id of the window last sent for a conversation
+        self._anchors: "OrderedDict[int, int]" = OrderedDict()
+        self.state: Optional[StateStore] = state
+        if state:
+            for key, message, tokens in state.load_fragments()[-cache_size:]:
+                self._render_cache[key] = (message, tokens)
+
+    def build(self,
+              system_prompt: str,
+              messages: List[TalkMessage],
+              conversation_id: Optional[int] = None,
+              speakers: bool = False) -> Tuple[List[Message], ContextReport]:
+        report = ContextReport(self.budget)
+        report.tokens = approximate_tokens(system_prompt)
+        rendered = [self.render(talk_message, speakers) for talk_message in messages]
+
+        anchor = self._anchors.get(conversation_id) if self.stable_prefix else None
+        count = None
+        if anchor is not None:
+            # keep the previous starting point while the window still fits, so the prefix does not slide
+            window = [index for index, talk_message in enumerate(messages) if talk_message.message_id >= anchor]
+            tokens = sum(rendered[index][1] for index in window)
+            if window and report.tokens + tokens <= self.budget:
+                count = len(window)
+        if count is None:
+            # re-anchor below the budget to leave room for the next few turns
+            target = self.budget * self.headroom if self.stable_prefix else self.budget
+            count = self._fit(rendered, report.tokens, target)
+
+        selected = rendered[:count]
+        report.tokens += sum(tokens for _, tokens in selected)
+        report.included = len(selected)
+        report.dropped = len(messages) - len(selected)
+        if self.stable_prefix and conversation_id is not None and selected:
+            self._anchors[conversation_id] = messages[count - 1].message_id
+            self._anchors.move_to_end(conversation_id)
+            if len(self._anchors) > self.max_anchors:
+                self._anchors.popitem(last=False)
+
+        return [Message(role="system", content=system_prompt)] + [message for message, _ in reversed(selected)], report
+
+    def _fit(self, rendered: List[Tuple[Message, int]], used: int, target: float) -> int:
+        # messages arrive newest first; keep the newest ones that fit, and always the latest one
+        count = 0
+        for _, tokens in rendered:
+            if count and used + tokens > target:
+                break
+            used += tokens
+            count += 1
+        return count
+
+    def render(self, talk_message: TalkMessage, speaker: bool = False) -> Tuple[Message, int]:
+        # edits and deletions replace the text under the same id, and the metadata style changes the rendering,
+        # so both are part of the key; a message id belongs to a single room, so its speaker flag never changes
+        digest = hashlib.blake2b(f"{self.metadata}\0{talk_message.message or ''}".encode(), digest_size=12).hexdigest()
+        key = (talk_message.message_id, digest)
+        cached = self._render_cache.get(key)
+        if cached is None:
+            message = self.mappers.talk_message_to_ollama_message(
+                talk_message, self.assistant_id, metadata=self.metadata, speaker=speaker)
+            cached = (message, approximate_tokens(message.content or ""))
+            self._render_cache[key] = cached
+            if self.state:
+                self.state.record_fragment(key, *cached)
+            if len(self._render_cache) > self.cache_size:
+                self._render_cache.popitem(last=False)
+        else:
+            self._render_cache.move_to_end(key)
+        return cached
@@ -0,0 +1,135 @@
+import time
+
+from nc_py_api.talk import Conversation
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from lib.state_store import StateStore
+
+
+def _fingerprint(conversation: Conversation) -> Tuple[int, int, Optional[int]]:
+    last_message = conversation._raw_data.get("lastMessage") or {}
+    return conversation.last_activity, conversation.unread_messages_count, last_message.get("id")
+
+
+class ConversationIndex:
+
+    def __init__(self,
+                 ttl: float = 10.0,
+                 full_refresh_interval: float = 600.0,
+                 state: Optional[StateStore] = None,
+                 on_remove: Optional[Callable[[int], None]] = None) -> None:
+        self.ttl: float = ttl
+        self.full_refresh_interval: float = full_refresh_interval
+        self.state: Optional[StateStore] = state
+        self.refreshed_at: float = 0.0
+        self.full_refreshed_at: float = 0.0
+        # Talk's X-Nextcloud-Talk-Modified-Before of the last listing; 0 until the index holds a full listing
+        self.cursor: int = 0
+        self._by_id: Dict[int, Conversation] = {}
+        self._by_token: Dict[str, int] = {}
+        self._fingerprints: Dict[int, Tuple[int, int, Optional[int]]] = {}
+        # conversations updated since the monitor last drained them, in arrival order
+        self._changed: Dict[int, None] = {}
+        # told about rooms that left the listing, so per-room state elsewhere does not outlive them
+        self.on_remove: Optional[Callable[[int], None]] = on_remove
+        if state:
+            self._restore(*state.load_conversations())
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, conversation_id: int) -> bool:
+        return conversation_id in self._by_id
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.refreshed_at > self.ttl
+
+    def needs_full_refresh(self) -> bool:
+        return not self.cursor or time.monotonic() - self.full_refreshed_at > self.full_refresh_interval
+
+    def get(self, conversation_id: int) -> Optional[Conversation]:
+        return self._by_id.get(conversation_id)
+
+    def get_by_token(self, token: str) -> Optional[Conversation]:
+        conversation_id = self._by_token.get(token)
+        return self._by_id.get(conversation_id) if conversation_id is not None else None
+
+    def unread(self, conversation_types: Iterable[str] = ("ONE_TO_ONE",)) -> List[Conversation]:
+        types = set(conversation_types)
+        return [conversation for conversation in self._by_id.values()
+                if conversation.unread_messages_count > 0 and conversation.conversation_type.name in types]
+
+    def _put(self, conversation: Conversation) -> bool:
+        conversation_id = conversation.conversation_id
+        fingerprint = _fingerprint(conversation)
+        changed = self._fingerprints.get(conversation_id) != fingerprint
+        self._by_id[conversation_id] = conversation
+        self._by_token[conversation.token] = conversation_id
+        self._fingerprints[conversation_id] = fingerprint
+        if changed:
+            self._changed[conversation_id] = None
+            if self.state:
+                self.state.record_conversation(conversation_id, conversation._raw_data)
+        return changed
+
+    def _advance(self, cursor: int) -> None:
+        if cursor > self.cursor:
+            self.cursor = cursor
+            if self.state:
+                self.state.record_cursor("conversations", cursor)
+
+    def merge(self, conversations: List[Conversation], cursor: int = 0) -> None:
+        # a delta may repeat rooms whose lastActivity equals the cursor; unchanged ones are not reported again
+        for conversation in conversations:
+            self._put(conversation)
+        self._advance(cursor)
+        self.refreshed_at = time.monotonic()
+
+    def replace(self, conversations: List[Conversation], cursor: int = 0) -> None:
+        listed = {conversation.conversation_id for conversation in conversations}
+        for conversation_id in [conversation_id for conversation_id in self._by_id if conversation_id not in listed]:
+            self._remove(conversation_id)
+        for conversation in conversations:
+            self._put(conversation)
+        self._advance(cursor)
+        self.refreshed_at = self.full_refreshed_at = time.monotonic()
+
+    def _remove(self, conversation_id: int) -> None:
+        conversation = self._by_id.pop(conversation_id)
+        self._by_token.pop(conversation.token, None)
+        self._fingerprints.pop(conversation_id, None)
+        self._changed.pop(conversation_id, None)
+        if self.state:
+            self.state.record_conversation(conversation_id, None)
+        if self.on_remove is not None:
+            self.on_remove(conversation_id)
+
+    def _restore(self, conversations: List[Conversation], cursor: int) -> None:
+        if not cursor:
+            return
+        for conversation in conversations:
+            conversation_id = conversation.conversation_id
+            self._by_id[conversation_id] = conversation
+            self._by_token[conversation.token] = conversation_id
+            self._fingerprints[conversation_id] = _fingerprint(conversation)
+            # rooms left unread at shutdown are offered again; answered ones are skipped by the processed log
+            if conversation.unread_messages_count > 0:
+                self._changed[conversation_id] = None
+        # the snapshot stands in for the startup listing, so polling resumes with a delta from the saved cursor
+        self.cursor = cursor
+        self.full_refreshed_at = time.monotonic()
+
+    def drain_changed(self) -> List[Conversation]:
+        changed = [self._by_id[conversation_id] for conversation_id in self._changed if conversation_id in self._by_id]
+        self._changed.clear()
+        return changed
+
+    def defer(self, conversations: List[Conversation]) -> None:
+        # handed back undelivered, so the next drain offers them again
+        for conversation in conversations:
+            if conversation.conversation_id in self._by_id:
+                self._changed[conversation.conversation_id] = None
+
+    def drain_unread(self, conversation_types: Iterable[str] = ("ONE_TO_ONE",)) -> List[Conversation]:
+        types = set(conversation_types)
+        return [conversation for conversation in self.drain_changed()
+                if conversation.unread_messages_count > 0 and conversation.conversation_type.name in types]
@@ -0,0 +1,63 @@
+import re
+
+from nc_py_api.talk import Conversation, TalkMessage
+from typing import Dict, Iterable, List, Optional
+
+
+class GroupTrigger:
+
+    def __init__(self, bot_ids: Iterable[str], keywords: Iterable[str] = ()) -> None:
+        self.bot_ids: frozenset = frozenset(bot_id for bot_id in bot_ids if bot_id)
+        # plain-text fallbacks for clients that do not turn "@bot" into a mention parameter
+        self._mention_text: Optional[re.Pattern] = self._words(f"@{bot_id}" for bot_id in self.bot_ids)
+        self._keywords: Optional[re.Pattern] = self._words(keywords)
+        # newest message id already checked per conversation, so chatter is only looked at once
+        self.checked: Dict[int, int] = {}
+
+    @staticmethod
+    def _words(words: Iterable[str]) -> Optional[re.Pattern]:
+        words = [word.strip() for word in words if word.strip()]
+        if not words:
+            return None
+        alternatives = "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+        return re.compile(rf"(?<![\w@])(?:{alternatives})(?!\w)", re.IGNORECASE)
+
+    def new_messages(self, conversation: Conversation, messages: List[TalkMessage]) -> List[TalkMessage]:
+        # messages arrive newest first; anything at or below the read marker was seen when the bot last spoke
+        seen = max(conversation._raw_data.get("lastReadMessage") or 0, self.checked.get(conversation.conversation_id, 0))
+        new = []
+        for message in messages:
+            if message.message_id <= seen:
+                break
+            new.append(message)
+        return new
+
+    def find(self, conversation: Conversation, messages: List[TalkMessage]) -> Optional[TalkMessage]:
+        new = self.new_messages(conversation, messages)
+        for message in new:
+            if message.actor_id in self.bot_ids or message.message_type != "comment":
+                continue
+            if self.matches(message):
+                return message
+        # only a miss is remembered: a triggered batch stays visible until it has been answered
+        if new:
+            self.advance(conversation.conversation_id, new[0].message_id)
+        return None
+
+    def advance(self, conversation_id: int, message_id: int) -> None:
+        if message_id > self.checked.get(conversation_id, 0):
+            self.checked[conversation_id] = message_id
+
+    def matches(self, message: TalkMessage) -> bool:
+        parameters = message.message_parameters
+        # Talk sends an empty list instead of an object when there are no parameters
+        for parameter in (parameters.values() if isinstance(parameters, dict) else ()):
+            if isinstance(parameter, dict) and parameter.get("type") == "user" and parameter.get("id") in self.bot_ids:
+                return True
+        parent = message.parent
+        if isinstance(parent, dict) and parent.get("actorId") in self.bot_ids:
+            return True
+        text = message.message or ""
+        if self._mention_text is not None and self._mention_text.search(text):
+            return True
+        return self._keywords is not None and self._keywords.search(text) is not None
@@ -0,0 +1,108 @@
+import time
+
+from httpx import AsyncClient, AsyncHTTPTransport, Limits, Request, Response, Timeout
+from lib.log_sink import get_logger
+from typing import Dict, Optional
+from lib.config import Config
+
+log = get_logger()
+
+
+class InstrumentedTransport(AsyncHTTPTransport):
+
+    def __init__(self, name: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.name: str = name
+        self.requests: int = 0
+        self.in_flight: int = 0
+        self.wait_time: float = 0.0
+
+    async def handle_async_request(self, request: Request) -> Response:
+        started = time.monotonic()
+        acquired: Optional[float] = None
+        previous = request.extensions.get("trace")
+
+        async def trace(event: str, info: dict) -> None:
+            nonlocal acquired
+            # httpcore only starts tracing once the pool has handed out a connection: the first event is
+            # either opening a new one or sending headers on a reused one
+            if acquired is None:
+                acquired = time.monotonic()
+            if previous is not None:
+                await previous(event, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.in_flight -= 1
+            # a request that never got a connection (pool timeout) waited all along
+            self.wait_time += (acquired if acquired is not None else time.monotonic()) - started
+
+    def stats(self) -> Dict[str, float]:
+        connections = self._pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "connections": len(connections),
+            "active": len(connections) - idle,
+            "idle": idle,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "avg_wait": self.wait_time / self.requests if self.requests else 0.0,
+        }
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HttpClients:
+
+    def __init__(self, conf: Optional[Config] = None) -> None:
+        self.conf: Config = conf or Config()
+        http2 = bool(int(self.conf.HTTP_HTTP2))
+        if http2 and not _http2_available():
+            log.warning("[HTTP] HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1.")
+            http2 = False
+        limits = Limits(
+            max_connections=int(self.conf.HTTP_MAX_CONNECTIONS),
+            max_keepalive_connections=int(self.conf.HTTP_MAX_KEEPALIVE),
+            keepalive_expiry=float(self.conf.HTTP_KEEPALIVE_EXPIRY),
+        )
+        self.nextcloud_transport: InstrumentedTransport = InstrumentedTransport(
+            "nextcloud", http2=http2, limits=limits, retries=5, verify=bool(int(self.conf.HTTP_VERIFY_SSL)))
+        self.ollama_transport: InstrumentedTransport = InstrumentedTransport(
+            "ollama", http2=http2, limits=limits, retries=2)
+        self.nextcloud_timeout: Timeout = Timeout(
+            float(self.conf.HTTP_READ_TIMEOUT), connect=float(self.conf.HTTP_CONNECT_TIMEOUT))
+        # generations can legitimately take minutes before the first byte
+        self.ollama_timeout: Timeout = Timeout(
+            float(self.conf.OLLAMA_TIMEOUT) or None, connect=float(self.conf.HTTP_CONNECT_TIMEOUT))
+        self._clients: list = []
+
+    def nextcloud_client(self) -> AsyncClient:
+        client = AsyncClient(transport=self.nextcloud_transport, timeout=self.nextcloud_timeout)
+        self._clients.append(client)
+        return client
+
+    def ollama_client_kwargs(self) -> dict:
+        return {"transport": self.ollama_transport, "timeout": self.ollama_timeout}
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            "nextcloud": self.nextcloud_transport.stats(),
+            "ollama": self.ollama_transport.stats(),
+        }
+
+    async def aclose(self) -> None:
+        for client in self._clients:
+            await client.aclose()
+        await self.nextcloud_transport.aclose()
+        await self.ollama_transport.aclose()
+        log.info("[HTTP] Connection pools closed.")
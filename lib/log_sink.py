@@ -0,0 +1,237 @@
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+from typing import Any, Callable, Dict, Optional, Tuple
+
+LEVELS: Dict[str, int] = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+# arguments of these types cannot change after the call, so formatting them can wait for the sink thread
+_IMMUTABLE: tuple = (str, int, float, bool, type(None))
+
+# (pathname, lineno, funcName) of the bot code that logged the record being emitted on this thread
+CallSite = Tuple[str, int, str]
+_emitting = threading.local()
+_previous_factory: Optional[Callable[..., logging.LogRecord]] = None
+
+
+def _call_site() -> CallSite:
+    # the first frame outside this module is the one that asked for the log line
+    frame = sys._getframe(1)
+    while frame.f_back is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    return frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name
+
+
+def _record_factory(*args, **kwargs) -> logging.LogRecord:
+    record = _previous_factory(*args, **kwargs)
+    site = getattr(_emitting, "site", None)
+    if site is not None:
+        # records are created here or in the sink thread, so %(filename)s would name this module otherwise
+        record.pathname, record.lineno, record.funcName = site
+        record.filename = os.path.basename(record.pathname)
+        record.module = os.path.splitext(record.filename)[0]
+    return record
+
+
+def _install_record_factory() -> None:
+    global _previous_factory
+    if _previous_factory is None:
+        _previous_factory = logging.getLogRecordFactory()
+        logging.setLogRecordFactory(_record_factory)
+
+
+def _emit(target: Any, level: str, text: str, site: Optional[CallSite]) -> None:
+    _emitting.site = site
+    try:
+        getattr(target, level)(text)
+    finally:
+        _emitting.site = None
+
+
+class LogSink:
+
+    def __init__(self, target: Any, max_queue: int = 10000) -> None:
+        self.target: Any = target
+        self.queue: "queue.Queue[Optional[Tuple[str, str, tuple, Optional[CallSite]]]]" = queue.Queue(maxsize=max_queue)
+        self.dropped: int = 0
+        self._thread: threading.Thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+        self._thread.start()
+
+    def submit(self, level: str, message: str, args: tuple = (), site: Optional[CallSite] = None) -> None:
+        try:
+            self.queue.put_nowait((level, message, args, site))
+        except queue.Full:
+            # never block the event loop on a slow disk; count what was lost instead
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                level, message, args, site = record
+                if self.dropped:
+                    dropped, self.dropped = self.dropped, 0
+                    self.target.warning(f"[Log] Dropped {dropped} log lines, the log queue was full.")
+                _emit(self.target, level, _format(message, args), site)
+            except Exception:
+                pass
+            finally:
+                self.queue.task_done()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        # the queue signals this condition whenever its last task is done, so there is nothing to poll
+        with self.queue.all_tasks_done:
+            self.queue.all_tasks_done.wait_for(lambda: not self.queue.unfinished_tasks, timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(timeout)
+
+
+def _format(message: str, args: tuple) -> str:
+    if not args:
+        return message
+    try:
+        return message % args
+    except (TypeError, ValueError):
+        return f"{message} {args!r}"
+
+
+class Span:
+
+    def __init__(self, logger: "BotLogger", name: str, level: str, fields: Dict[str, Any]) -> None:
+        self.logger: "BotLogger" = logger
+        self.name: str = name
+        self.level: str = level
+        self.fields: Dict[str, Any] = fields
+        self.started: float = 0.0
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def __enter__(self) -> "Span":
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        level = self.level
+        if exc_type is not None:
+            self.fields.setdefault("status", "cancelled" if exc_type.__name__ == "CancelledError" else "error")
+            if exc is not None and exc_type.__name__ != "CancelledError":
+                self.fields.setdefault("error", f"{exc_type.__name__}: {exc}")
+                level = "warning" if LEVELS[level.upper()] < LEVELS["WARNING"] else level
+        else:
+            self.fields.setdefault("status", "ok")
+        if not self.logger.is_enabled_for(level):
+            return
+        duration = (time.monotonic() - self.started) * 1000
+        fields = " ".join(f"{key}={value}" for key, value in self.fields.items())
+        self.logger.log(level, "[Span] %s %.1fms %s", self.name, duration, fields)
+
+
+class BotLogger:
+
+    def __init__(self, target: Any = None, level: Optional[str] = None, background: Optional[bool] = None,
+                 max_queue: Optional[int] = None) -> None:
+        # everything is resolved on first use, so importing a module never reads the configuration
+        self._target: Any = target
+        self._level: Optional[int] = LEVELS.get(level.upper()) if level else None
+        self._background: Optional[bool] = background
+        self._max_queue: Optional[int] = max_queue
+        self._sink: Optional[LogSink] = None
+        self._ready: bool = False
+        self._lock: threading.Lock = threading.Lock()
+        # key -> (last emitted at, suppressed since then)
+        self._samples: Dict[str, Tuple[float, int]] = {}
+
+    def _setup(self) -> None:
+        with self._lock:
+            if self._ready:
+                return
+            from lib.config import Config
+            conf = Config()
+            if self._target is None:
+                from simple_logger import Logger
+                self._target = Logger()
+            if self._level is None:
+                self._level = LEVELS.get(str(conf.LOG_LEVEL).upper(), LEVELS["INFO"])
+            if self._background is None:
+                self._background = bool(int(conf.LOG_ASYNC))
+            _install_record_factory()
+            if self._background:
+                self._sink = LogSink(self._target, max_queue=self._max_queue or int(conf.LOG_QUEUE_SIZE))
+                atexit.register(self.close)
+            self._ready = True
+
+    def is_enabled_for(self, level: str) -> bool:
+        if not self._ready:
+            self._setup()
+        return LEVELS[level.upper()] >= self._level
+
+    def log(self, level: str, message: str, *args) -> None:
+        if not self.is_enabled_for(level):
+            return
+        site = _call_site()
+        if self._sink is not None:
+            if all(type(arg) in _IMMUTABLE for arg in args):
+                self._sink.submit(level, message, args, site)
+            else:
+                self._sink.submit(level, _format(message, args), site=site)
+        else:
+            _emit(self._target, level, _format(message, args), site)
+
+    def debug(self, message: str, *args) -> None:
+        self.log("debug", message, *args)
+
+    def info(self, message: str, *args) -> None:
+        self.log("info", message, *args)
+
+    def warning(self, message: str, *args) -> None:
+        self.log("warning", message, *args)
+
+    def error(self, message: str, *args) -> None:
+        self.log("error", message, *args)
+
+    def sampled(self, key: str, interval: float, level: str, message: str, *args) -> None:
+        # repetitive lines (poll heartbeats) are written at most once per interval per key
+        if not self.is_enabled_for(level):
+            return
+        now = time.monotonic()
+        last, suppressed = self._samples.get(key, (0.0, 0))
+        if last and now - last < interval:
+            self._samples[key] = (last, suppressed + 1)
+            return
+        self._samples[key] = (now, 0)
+        if suppressed:
+            message += f" (+{suppressed} similar in the last {now - last:.0f}s)"
+        self.log(level, message, *args)
+
+    def span(self, name: str, level: str = "debug", **fields) -> Span:
+        return Span(self, name, level, fields)
+
+    def flush(self, timeout: float = 5.0) -> None:
+        if self._sink is not None:
+            self._sink.flush(timeout)
+
+    def close(self) -> None:
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+_logger: Optional[BotLogger] = None
+
+
+def get_logger() -> BotLogger:
+    global _logger
+    if _logger is None:
+        _logger = BotLogger()
+    return _logger
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from nc_py_api.talk import TalkMessage
+from typing import Dict, List, Optional
+
+# System messages that carry an updated copy of the message they refer to in `parent`
+PARENT_UPDATE_SYSTEM_MESSAGES: tuple = (
+    "message_deleted",
+    "message_edited",
+    "reaction",
+    "reaction_deleted",
+    "reaction_revoked",
+)
+
+
+class ConversationMessages:
+
+    def __init__(self, max_messages: int) -> None:
+        self.max_messages: int = max_messages
+        self.messages: Dict[int, TalkMessage] = {}
+        self.last_known_id: int = 0
+
+    def merge(self, messages: List[TalkMessage]) -> int:
+        added = 0
+        for message in messages:
+            if message.message_id not in self.messages:
+                added += 1
+            self.messages[message.message_id] = message
+            self.last_known_id = max(self.last_known_id, message.message_id)
+
+            parent = message.parent
+            if message.system_message in PARENT_UPDATE_SYSTEM_MESSAGES and isinstance(parent, dict):
+                parent_id = parent.get("id")
+                if parent_id in self.messages:
+                    self.messages[parent_id] = TalkMessage(parent)
+
+        if len(self.messages) > self.max_messages:
+            for message_id in sorted(self.messages)[:len(self.messages) - self.max_messages]:
+                del self.messages[message_id]
+        return added
+
+    def newest_first(self) -> List[TalkMessage]:
+        return [self.messages[message_id] for message_id in sorted(self.messages, reverse=True)]
+
+    def get(self, message_id: int) -> Optional[TalkMessage]:
+        return self.messages.get(message_id)
+
+
+class MessageCache:
+
+    def __init__(self, max_conversations: int = 500, max_messages: int = 200) -> None:
+        self.max_conversations: int = max_conversations
+        self.max_messages: int = max_messages
+        self._conversations: "OrderedDict[int, ConversationMessages]" = OrderedDict()
+
+    def __contains__(self, conversation_id: int) -> bool:
+        return conversation_id in self._conversations
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def get(self, conversation_id: int) -> Optional[ConversationMessages]:
+        entry = self._conversations.get(conversation_id)
+        if entry is not None:
+            self._conversations.move_to_end(conversation_id)
+        return entry
+
+    def seed(self, conversation_id: int, messages: List[TalkMessage]) -> ConversationMessages:
+        entry = ConversationMessages(self.max_messages)
+        entry.merge(messages)
+        self._conversations[conversation_id] = entry
+        self._conversations.move_to_end(conversation_id)
+        self._evict()
+        return entry
+
+    def merge(self, conversation_id: int, messages: List[TalkMessage]) -> int:
+        entry = self.get(conversation_id)
+        if entry is None:
+            self.seed(conversation_id, messages)
+            return len(messages)
+        return entry.merge(messages)
+
+    def find(self, conversation_id: int, message_id: int) -> Optional[TalkMessage]:
+        entry = self.get(conversation_id)
+        return entry.get(message_id) if entry else None
+
+    def invalidate(self, conversation_id: int) -> None:
+        self._conversations.pop(conversation_id, None)
+
+    def _evict(self) -> None:
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
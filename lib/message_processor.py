@@ -1,14 +1,47 @@
 import asyncio
+import time
 
 from nc_py_api.talk import TalkMessage, Conversation
 from lib.nextcloud_client import NextcloudClient
 from lib.ollama_client import OllamaChat, Message
-from simple_logger import Logger
-from typing import List
-from lib.constants import REACTIONS
+from lib.log_sink import get_logger
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from lib.constants import REACTIONS, SUPERSEDED_MARKER
 from lib.utils import Mappers, Filters
+from lib.streaming import StreamingReply
+from lib.config import Config
+from lib.work_queue import KeyedWorkQueue, AgingPriorityQueue
+from lib.context_builder import ContextBuilder
+from lib.group_trigger import GroupTrigger
+from lib.response_cache import ResponseCache
+from lib.state_store import StateStore
+from lib.metrics import QUEUE_COALESCED, QUEUE_WAIT, REPLIES, REPLY_LATENCY, RESPONSE_CACHE, WORKER_RESTARTS
 
-log = Logger()
+log = get_logger()
+
+
+class GenerationSuperseded(Exception):
+    pass
+
+
+class GenerationJob:
+
+    def __init__(self,
+                 conversation: Conversation,
+                 last_message: TalkMessage,
+                 ollama_messages: List[Message],
+                 prompt_tokens: int,
+                 group: bool = False,
+                 newest_id: int = 0,
+                 cache_key: Optional[str] = None):
+        self.conversation: Conversation = conversation
+        self.last_message: TalkMessage = last_message
+        self.ollama_messages: List[Message] = ollama_messages
+        self.prompt_tokens: int = prompt_tokens
+        # in a group the job answers one addressed message, not whatever was said last
+        self.group: bool = group
+        self.newest_id: int = newest_id
+        self.cache_key: Optional[str] = cache_key
 
 
 class MessageProcessor:
@@ -16,26 +49,106 @@ class MessageProcessor:
     def __init__(self,
                  nc_bot: NextcloudClient,
                  ollama: OllamaChat,
-                 max_workers: int = 3):
-        self.queue: asyncio.Queue = asyncio.Queue()
+                 max_workers: Optional[int] = None,
+                 max_generations: Optional[int] = None,
+                 state: Optional[StateStore] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 conf: Optional[Config] = None):
+        self.conf: Config = conf or Config()
+        self.state: Optional[StateStore] = state
+        self.response_cache: Optional[ResponseCache] = response_cache
+        self.queue: KeyedWorkQueue = KeyedWorkQueue(
+            key=lambda conversation: conversation.conversation_id,
+            version=lambda conversation: conversation.last_message.message_id
+            if conversation.last_message else None,
+            on_wait=lambda waited: QUEUE_WAIT.observe(waited, stage="prepare"),
+            on_coalesce=lambda where: QUEUE_COALESCED.inc(state=where))
+        if state:
+            # conversations answered before a restart are not fetched and answered again
+            self.queue.restore_completed(state.load_processed())
+        self.generation_queue: AgingPriorityQueue = AgingPriorityQueue(
+            cost=(lambda job: job.prompt_tokens) if self.conf.OLLAMA_PRIORITY == "shortest" else (lambda job: 0.0),
+            aging=float(self.conf.OLLAMA_PRIORITY_AGING) if self.conf.OLLAMA_PRIORITY == "shortest" else 1.0,
+            on_wait=lambda waited: QUEUE_WAIT.observe(waited, stage="generation"))
         self.nc_bot: NextcloudClient = nc_bot
         self.ollama: OllamaChat = ollama
-        self.max_workers: int = max_workers
+        self.max_workers: int = max_workers or int(self.conf.NEXTCLOUD_IO_WORKERS)
+        # sized to the pool unless set explicitly, so added backends or concurrency are actually used
+        self.max_generations: int = max_generations or int(self.conf.OLLAMA_MAX_PARALLEL) or self.ollama.capacity
+        # conversations waiting or in progress at once; beyond this the monitor leaves new ones for a later poll
+        self.queue_limit: int = int(self.conf.NEXTCLOUD_QUEUE_LIMIT)
+        self.generation_slots: asyncio.Semaphore = asyncio.Semaphore(self.max_generations)
         self.running: bool = False
+        self.in_flight: int = 0
+        self.generations: Dict[int, asyncio.Task] = {}
+        self._superseded: Dict[int, bool] = {}
+        self.settle_window: float = float(self.conf.NEXTCLOUD_SETTLE_WINDOW)
+        # when the bot first saw each conversation's latest message, on the local clock
+        self._seen_at: Dict[int, float] = {}
+        self._settling: Set[asyncio.Task] = set()
+        # set when a newer message arrives for a conversation whose prompt is waiting to settle
+        self._settle_wakeups: Dict[int, asyncio.Event] = {}
         self.filters: Filters = Filters()
         self.mappers: Mappers = Mappers()
+        self.context_builder: ContextBuilder = ContextBuilder(
+            assistant_id=self.ollama.assistant_id,
+            budget=int(self.conf.OLLAMA_CONTEXT_TOKENS),
+            metadata=self.conf.OLLAMA_CONTEXT_METADATA,
+            stable_prefix=bool(int(self.conf.OLLAMA_STABLE_PREFIX)),
+            state=state)
+        self.group_window: int = int(self.conf.GROUP_WINDOW)
+        self.group_trigger: GroupTrigger = GroupTrigger(
+            bot_ids=(self.conf.OLLAMA_ACTOR_ID, self.conf.NEXTCLOUD_USERNAME),
+            keywords=self.conf.GROUP_KEYWORDS.split(","))
+
+    @staticmethod
+    def is_group(conversation: Conversation) -> bool:
+        return conversation.conversation_type.name != "ONE_TO_ONE"
 
     async def start_workers(self):
         self.running = True
         workers = [
-            asyncio.create_task(self.worker()) for _ in range(self.max_workers)
+            asyncio.create_task(self.supervise("worker", self.worker)) for _ in range(self.max_workers)
         ]
+        workers.append(asyncio.create_task(self.supervise("dispatcher", self.dispatcher)))
         await asyncio.gather(*workers)
 
+    async def supervise(self, name: str, target: Callable[[], Awaitable[None]]):
+        crashes = 0
+        while self.running:
+            try:
+                await target()
+                return
+            except Exception as e:
+                crashes += 1
+                WORKER_RESTARTS.inc(task=name)
+                log.error("[Worker] %s crashed: %s; restarting.", name, e)
+                # back off so a persistent fault does not turn into a busy loop
+                await asyncio.sleep(min(30.0, 0.5 * 2 ** min(crashes, 6)))
+
+    def pending(self) -> int:
+        return self.queue.qsize() + self.in_flight
+
+    def accepts(self, conversation: Conversation) -> bool:
+        # a conversation already known to the queue only replaces its own entry, so it never adds to the backlog
+        return self.queue.is_known(conversation) or self.pending() < self.queue_limit
+
+    async def drain(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return not self.pending()
+
     async def stop_workers(self):
         self.running = False
+        for task in list(self._settling):
+            task.cancel()
+        # whatever is still generating is cut short and not recorded as answered, so it is picked up after a restart
+        for task in list(self.generations.values()):
+            task.cancel()
         for _ in range(self.max_workers):
             await self.queue.put(None)
+        self.generation_queue.close()
 
     async def worker(self):
         while self.running:
@@ -43,90 +156,349 @@ class MessageProcessor:
             if conversation is None:
                 break
 
+            self.in_flight += 1
+            job: Optional[GenerationJob] = None
             try:
-                log.info(
-                    f"[Worker] Fetching messages for {conversation.display_name}..."
+                job = await self.prepare(conversation)
+            except Exception as e:
+                log.error(
+                    "[Worker] Error processing conversation %s: %s", conversation.display_name, e
                 )
-                messages: List[
-                    TalkMessage] = await self.nc_bot.retrieve_conversation_history(
-                        conversation.conversation_id)
+                REPLIES.inc(outcome="failed", reason="prepare")
+                self.finish(conversation, completed=False)
+                if conversation.last_message is not None:
+                    await self.nc_bot.set_reaction(
+                        conversation=conversation,
+                        message=conversation.last_message,
+                        reaction=REACTIONS.get("FAILED"))
+                continue
 
-                if messages:
-                    log.info(
-                        f"[Worker] Processing {len(messages)} messages from {conversation.display_name}..."
-                    )
+            try:
+                if job is None:
+                    self.finish(conversation)
+                else:
+                    self.hand_off(job)
+            except Exception:
+                # the conversation must not stay marked as in progress when its worker dies
+                self.finish(conversation, completed=False)
+                raise
+
+    def hand_off(self, job: GenerationJob):
+        delay = 0.0 if job.group else self.settle_delay(job.conversation, job.last_message)
+        if delay <= 0:
+            self.generation_queue.put_nowait(job)
+            return
+        # the worker moves on; the prepared prompt waits here for the burst to end
+        task = asyncio.create_task(self.settle(job, delay))
+        self._settling.add(task)
+        task.add_done_callback(self._settling.discard)
+
+    def settle_delay(self, conversation: Conversation, last_message: TalkMessage) -> float:
+        if self.settle_window <= 0:
+            return 0.0
+        seen_at = self._seen_at.get(conversation.conversation_id, time.monotonic())
+        local = seen_at + self.settle_window - time.monotonic()
+        # the server timestamp lets old messages (after a restart, say) through at once;
+        # the local clock covers a Nextcloud clock that runs ahead
+        server = (last_message.timestamp or 0) + self.settle_window - time.time()
+        return min(local, server)
+
+    async def settle(self, job: GenerationJob, delay: float):
+        conversation = job.conversation
+        wakeup = self._settle_wakeups[conversation.conversation_id] = asyncio.Event()
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            self.finish(conversation, completed=False)
+            raise
+        finally:
+            self._settle_wakeups.pop(conversation.conversation_id, None)
+        QUEUE_WAIT.observe(time.monotonic() - started, stage="settle")
+        if self.queue.is_dirty(conversation):
+            # the user kept typing: drop this prompt, the newer version is prepared on top of the cached history
+            log.debug("[Worker] %s is still receiving messages; preparing again.", conversation.display_name)
+            self.finish(conversation, completed=False)
+            return
+        self.generation_queue.put_nowait(job)
+
+    async def prepare(self, conversation: Conversation) -> Optional[GenerationJob]:
+        with log.span("prepare", conversation=conversation.conversation_id) as span:
+            job = await self._prepare(conversation)
+            span.set(prompt_tokens=job.prompt_tokens if job else 0, skipped=job is None)
+        return job
+
+    async def _prepare(self, conversation: Conversation) -> Optional[GenerationJob]:
+        messages: List[
+            TalkMessage] = await self.nc_bot.retrieve_conversation_history(
+                conversation.conversation_id)
+
+        if not messages:
+            log.info(
+                "[Worker] No new messages found for %s. Skipping.", conversation.display_name
+            )
+            return None
+
+        group = self.is_group(conversation)
+        trigger: Optional[TalkMessage] = None
+        if group:
+            # decided without the model: only messages that address the bot cost a generation
+            trigger = self.group_trigger.find(conversation, messages)
+            if trigger is None:
+                log.debug("[Worker] Nothing in %s addresses the bot; skipping.", conversation.display_name)
+                REPLIES.inc(outcome="ignored", reason="not_addressed")
+                return None
+            await self.nc_bot.clear_reactions(conversation=conversation)
+            await self.nc_bot.set_reaction(conversation=conversation, message=trigger, reaction=REACTIONS.get("SEEN"))
+
+        filtered_messages: List[
+            TalkMessage] = self.filters.filter_useful_messages(
+                messages=messages)
+        if group:
+            # anchored on the trigger, so a busy room cannot push the question out of the window
+            start = next((index for index, message in enumerate(filtered_messages)
+                          if message.message_id <= trigger.message_id), 0)
+            filtered_messages = filtered_messages[start:start + self.group_window]
+
+        if trigger is not None:
+            last_message: TalkMessage = trigger
+        else:
+            last_message = await self.nc_bot.retrieve_message_by_id(
+                conversation_id=conversation.conversation_id,
+                message_id=conversation.last_message.message_id
+            )  # type:ignore
 
-                    filtered_messages: List[
-                        TalkMessage] = self.filters.filter_useful_messages(
-                            messages=messages)
-                    ollama_messages: List[Message] = [
-                        Message(role="system",
-                                content=self.ollama.system_prompt)
-                    ]
-                    ollama_messages.extend(
-                        self.mappers.talk_message_to_ollama_message(
-                            message, self.ollama.assistant_id)
-                        for message in reversed(filtered_messages))
-
-                    last_message: TalkMessage = await self.nc_bot.retrieve_message_by_id(
-                        conversation_id=conversation.conversation_id,
-                        message_id=conversation.last_message.message_id
-                    )  # type:ignore
+        cache_key: Optional[str] = None
+        # a group answer is tied to who asked and what was said around it, so only direct chats use the cache
+        if self.response_cache is not None and not group and self.response_cache.enabled_for(conversation):
+            filtered_messages = self.response_cache.window(filtered_messages)
+            cache_key = self.response_cache.key(
+                self.ollama.system_prompt, self.ollama.model, filtered_messages, self.ollama.assistant_id)
+            cached = self.response_cache.get(cache_key)
+            if cache_key is not None:
+                RESPONSE_CACHE.inc(result="hit" if cached is not None else "miss")
+            if cached is not None:
+                await self.answer_from_cache(conversation, last_message, cached)
+                return None
 
+        ollama_messages, report = self.context_builder.build(
+            self.ollama.system_prompt, filtered_messages,
+            conversation_id=conversation.conversation_id,
+            speakers=group)
+        if report.truncated:
+            log.info(
+                "[Worker] Context for %s truncated: %s", conversation.display_name, report
+            )
+
+        log.debug("[Worker] %d messages, %d after filtering, %d sent to Ollama.",
+                  len(messages), len(filtered_messages), len(ollama_messages))
+        return GenerationJob(conversation, last_message, ollama_messages, report.tokens,
+                             group=group, newest_id=messages[0].message_id, cache_key=cache_key)
+
+    async def dispatcher(self):
+        # a slot is taken before a job is picked, so the priority order is decided at the last moment
+        tasks = set()
+        while self.running:
+            await self.generation_slots.acquire()
+            job: Optional[GenerationJob] = await self.generation_queue.get()
+            if job is None:
+                self.generation_slots.release()
+                break
+            task = asyncio.create_task(self.run_generation(job))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run_generation(self, job: GenerationJob):
+        conversation = job.conversation
+        last_message = job.last_message
+        completed = True
+        with log.span("generation", level="info", conversation=conversation.conversation_id,
+                      prompt_tokens=job.prompt_tokens) as span:
+            try:
+                if not job.group and self.queue.is_dirty(conversation):
+                    # a newer message arrived while this job was waiting for a slot
+                    log.info(
+                        "[Worker] %s changed while waiting; skipping stale generation.", conversation.display_name
+                    )
+                    REPLIES.inc(outcome="ignored", reason="stale")
+                    span.set(outcome="stale")
                     await self.nc_bot.set_reaction(
                         conversation=conversation,
                         message=last_message,
-                        reaction=REACTIONS.get("ANSWERING"))
-                    log.debug(f"messages:{len(messages)}")
-                    log.debug(f"filtered messages:{len(filtered_messages)}")
-                    log.debug(f"ollama messages:{len(ollama_messages)}")
-                    response = await self.ollama.send_message_chat(
-                        ollama_messages)
-                    cleaned_response = Filters.trim_thought(response)
-
-                    updated_conv: Conversation = await self.nc_bot.retrieve_conversation_by_id(
-                        conversation.conversation_id)
-                    new_last_message: TalkMessage = updated_conv.last_message  # type:ignore
-
-                    if last_message.message_id == new_last_message.message_id:
-                        answered: bool = await self.nc_bot.reply_to_conversation(
-                            conversation, cleaned_response)  # type:ignore
-                        log.info(
-                            f"[Worker] Replied to {conversation.display_name}."
-                        )
-
-                        if answered:
-                            await self.nc_bot.set_reaction(
-                                conversation=conversation,
-                                message=last_message,
-                                reaction=REACTIONS.get("ANSWERED"))
-                    else:
-                        log.debug(
-                            "[Worker] Last message is outdated, discarding answer."
-                        )
-                        await self.nc_bot.set_reaction(
-                            conversation=conversation,
-                            message=last_message,
-                            reaction=REACTIONS.get("IGNORED"))
+                        reaction=REACTIONS.get("IGNORED"))
+                    return
 
-                else:
+                await self.nc_bot.set_reaction(
+                    conversation=conversation,
+                    message=last_message,
+                    reaction=REACTIONS.get("ANSWERING"))
+                try:
+                    if self.ollama.stream:
+                        answer = await self.stream_reply(conversation, last_message, job.ollama_messages, job.prompt_tokens)
+                    else:
+                        answer = await self.send_reply(conversation, last_message, job.ollama_messages, job.prompt_tokens,
+                                                       group=job.group)
+                    if self.response_cache is not None and answer:
+                        self.response_cache.put(job.cache_key, answer)
+                except GenerationSuperseded:
                     log.info(
-                        f"[Worker] No new messages found for {conversation.display_name}. Skipping."
+                        "[Worker] Generation for %s cancelled by a newer message.", conversation.display_name
                     )
+                    REPLIES.inc(outcome="ignored", reason="superseded")
+                    span.set(outcome="superseded")
+                    await self.nc_bot.set_reaction(
+                        conversation=conversation,
+                        message=last_message,
+                        reaction=REACTIONS.get("IGNORED"))
 
+            except asyncio.CancelledError:
+                completed = False
+                raise
             except Exception as e:
+                completed = False
+                REPLIES.inc(outcome="failed", reason="generation")
+                span.set(outcome="failed")
                 log.error(
-                    f"[Worker] Error processing conversation {conversation.display_name}: {e}"
+                    "[Worker] Error processing conversation %s: %s", conversation.display_name, e
                 )
                 await self.nc_bot.set_reaction(
                     conversation=conversation,
                     message=last_message,
                     reaction=REACTIONS.get("FAILED"))
             finally:
-                self.queue.task_done()
+                if job.group and completed:
+                    # everything fetched with the addressed message was in the answered window
+                    self.group_trigger.advance(conversation.conversation_id, job.newest_id)
+                self.generation_slots.release()
+                self.finish(conversation, completed=completed)
+
+    def finish(self, conversation: Conversation, completed: bool = True):
+        self.in_flight -= 1
+        self.queue.task_done(conversation, completed=completed)
+        if not self.queue.is_known(conversation):
+            # nothing newer is waiting, so the settle window has no burst left to measure
+            self._seen_at.pop(conversation.conversation_id, None)
+        if completed and self.state and conversation.last_message is not None:
+            self.state.record_processed(conversation.conversation_id, conversation.last_message.message_id)
+
+    async def send_reply(self, conversation: Conversation, last_message: TalkMessage, ollama_messages: List[Message], prompt_tokens: Optional[int] = None, group: bool = False):
+        response = await self.generate(
+            conversation, self.ollama.send_message_chat(
+                ollama_messages,
+                prompt_tokens=prompt_tokens,
+                affinity_key=conversation.conversation_id))
+        cleaned_response = Filters.trim_thought(response)
+
+        if group:
+            # other people talking meanwhile does not make an answer to the addressed message outdated
+            outdated = False
+        else:
+            updated_conv: Conversation = await self.nc_bot.retrieve_conversation_by_id(
+                conversation.conversation_id, fresh=True)
+            new_last_message: TalkMessage = updated_conv.last_message  # type:ignore
+            outdated = last_message.message_id != new_last_message.message_id
+
+        if not outdated:
+            answered: bool = await self.nc_bot.reply_to_conversation(
+                conversation, cleaned_response)  # type:ignore
+            log.info("[Worker] Replied to %s.", conversation.display_name)
+            self.record_answered(last_message)
+
+            if answered:
+                await self.nc_bot.set_reaction(
+                    conversation=conversation,
+                    message=last_message,
+                    reaction=REACTIONS.get("ANSWERED"))
+        else:
+            log.debug("[Worker] Last message is outdated, discarding answer.")
+            REPLIES.inc(outcome="ignored", reason="outdated")
+            await self.nc_bot.set_reaction(conversation=conversation,
+                                           message=last_message,
+                                           reaction=REACTIONS.get("IGNORED"))
+        # still a valid answer to the question it was generated for, even when it arrived too late to post
+        return cleaned_response
+
+    async def stream_reply(self, conversation: Conversation, last_message: TalkMessage, ollama_messages: List[Message], prompt_tokens: Optional[int] = None):
+        # the reply becomes visible while it is generated; a superseded one is marked rather than left cut off
+        reply = StreamingReply(
+            self.nc_bot,
+            conversation,
+            first_chars=int(self.conf.OLLAMA_STREAM_FIRST_CHARS),
+            first_delay=float(self.conf.OLLAMA_STREAM_FIRST_DELAY),
+            edit_interval=float(self.conf.OLLAMA_STREAM_EDIT_INTERVAL))
+        try:
+            text = await self.generate(
+                conversation, reply.run(self.ollama.stream_message_chat(
+                    ollama_messages,
+                    prompt_tokens=prompt_tokens,
+                    affinity_key=conversation.conversation_id)))
+        except GenerationSuperseded:
+            await reply.abandon(SUPERSEDED_MARKER)
+            raise
+        log.info("[Worker] Streamed reply to %s.", conversation.display_name)
+        self.record_answered(last_message)
+        await self.nc_bot.set_reaction(conversation=conversation,
+                                       message=last_message,
+                                       reaction=REACTIONS.get("ANSWERED"))
+        return text
+
+    async def answer_from_cache(self, conversation: Conversation, last_message: TalkMessage, response: str):
+        # posted straight from the worker: a cached answer needs no generation slot
+        answered = await self.nc_bot.reply_to_conversation(conversation, response)
+        log.info("[Worker] Replied to %s from the response cache.", conversation.display_name)
+        self.record_answered(last_message)
+        if answered:
+            await self.nc_bot.set_reaction(conversation=conversation,
+                                           message=last_message,
+                                           reaction=REACTIONS.get("ANSWERED"))
+
+    def record_answered(self, last_message: TalkMessage):
+        REPLIES.inc(outcome="answered", reason="none")
+        if last_message.timestamp:
+            REPLY_LATENCY.observe(max(0.0, time.time() - last_message.timestamp))
 
-    async def add_to_queue(self, conversation: Conversation):
-        log.info(
-            f"[Worker] Adding messages from {conversation.display_name} to queue..."
+    async def generate(self, conversation: Conversation, generation: Awaitable[Any]) -> Any:
+        task = asyncio.ensure_future(generation)
+        self.generations[conversation.conversation_id] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # only swallow cancellations we asked for, not a shutdown of the worker itself
+            if self._superseded.pop(conversation.conversation_id, False):
+                raise GenerationSuperseded()
+            raise
+        finally:
+            self.generations.pop(conversation.conversation_id, None)
+            self._superseded.pop(conversation.conversation_id, None)
+
+    def cancel_generation(self, conversation: Conversation) -> bool:
+        task = self.generations.get(conversation.conversation_id)
+        if task is None or task.done():
+            return False
+        self._superseded[conversation.conversation_id] = True
+        # closes the HTTP stream, which makes Ollama abort the request and free the slot
+        task.cancel()
+        return True
+
+    async def add_to_queue(self, conversation: Conversation) -> bool:
+        if await self.queue.put(conversation):
+            self._seen_at[conversation.conversation_id] = time.monotonic()
+            wakeup = self._settle_wakeups.get(conversation.conversation_id)
+            if wakeup is not None:
+                wakeup.set()
+            log.info(
+                "[Worker] Adding messages from %s to queue...", conversation.display_name
+            )
+            if self.queue.is_in_flight(conversation) and not self.is_group(conversation) \
+                    and self.cancel_generation(conversation):
+                log.info(
+                    "[Worker] Newer message in %s; cancelling running generation.", conversation.display_name
+                )
+            return True
+        log.debug(
+            "[Worker] %s is already queued or running with this message; skipping.", conversation.display_name
         )
-        await self.queue.put((conversation))
+        return False
@@ -0,0 +1,240 @@
+import bisect
+import time
+
+from lib.log_sink import get_logger
+from typing import Callable, Dict, Iterable, List, Tuple
+
+log = get_logger()
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS: Tuple[float, ...] = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+GENERATION_BUCKETS: Tuple[float, ...] = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind: str = "untyped"
+
+    def __init__(self, registry: "Registry", name: str, description: str) -> None:
+        self.registry: "Registry" = registry
+        self.name: str = name
+        self.description: str = description
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> List[str]:
+        lines = list(self.samples())
+        if not lines:
+            return []
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"] + lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, registry: "Registry", name: str, description: str) -> None:
+        super().__init__(registry, name, description)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        # the enabled check is the whole cost of an instrument while metrics are off
+        if not self.registry.enabled:
+            return
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self.values.items():
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        if not self.registry.enabled:
+            return
+        self.values[_label_key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "Registry", name: str, description: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(registry, name, description)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self.counts: Dict[LabelKey, List[int]] = {}
+        self.sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        if not self.registry.enabled:
+            return
+        key = _label_key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            # one slot per bucket plus +Inf; cumulated only when rendered
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def time(self, **labels) -> "Timer":
+        return Timer(self, labels)
+
+    def samples(self) -> Iterable[str]:
+        for key, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(key)} {_format_value(self.sums[key])}"
+            yield f"{self.name}_count{_format_labels(key)} {cumulative}"
+
+
+class Timer:
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, object]) -> None:
+        self.histogram: Histogram = histogram
+        self.labels: Dict[str, object] = labels
+        self.started: float = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.monotonic() - self.started, **self.labels)
+
+
+class Registry:
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled: bool = enabled
+        self.metrics: List[Metric] = []
+        # called on every scrape to refresh gauges that are cheaper to read than to track
+        self.collectors: List[Callable[[], None]] = []
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._add(Counter(self, name, description))
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._add(Gauge(self, name, description))
+
+    def histogram(self, name: str, description: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, name, description, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                log.warning(f"[Metrics] Collector {collector} failed: {e}")
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+POLL_DURATION = REGISTRY.histogram(
+    "talkbot_poll_duration_seconds", "Time spent checking Nextcloud for unread conversations.")
+POLL_CONVERSATIONS = REGISTRY.counter(
+    "talkbot_poll_conversations_total", "Conversations with unread messages found by polls.")
+QUEUE_DEPTH = REGISTRY.gauge(
+    "talkbot_queue_depth", "Items waiting or running per processing stage.")
+QUEUE_COALESCED = REGISTRY.counter(
+    "talkbot_queue_coalesced_total", "Conversation updates folded into work already completed, running or pending.")
+QUEUE_OLDEST_WAIT = REGISTRY.gauge(
+    "talkbot_queue_oldest_wait_seconds", "Age of the oldest job waiting for a generation slot.")
+QUEUE_WAIT = REGISTRY.histogram(
+    "talkbot_queue_wait_seconds", "Time an item waited in a stage queue before being picked up.", GENERATION_BUCKETS)
+NEXTCLOUD_LATENCY = REGISTRY.histogram(
+    "talkbot_nextcloud_request_seconds", "Latency of a single Nextcloud call attempt.")
+RETRIES = REGISTRY.counter(
+    "talkbot_retries_total", "Call attempts that failed and were retried.")
+RETRY_GIVE_UPS = REGISTRY.counter(
+    "talkbot_retry_give_ups_total", "Calls that failed after their last allowed attempt.")
+OLLAMA_TOKENS = REGISTRY.counter(
+    "talkbot_ollama_tokens_total", "Tokens processed by Ollama, by phase (prompt or eval).")
+OLLAMA_DURATION = REGISTRY.histogram(
+    "talkbot_ollama_duration_seconds", "Ollama time per request, by phase (load, prompt, eval, total).", GENERATION_BUCKETS)
+REPLIES = REGISTRY.counter(
+    "talkbot_replies_total", "Processed messages by outcome (answered, ignored, failed) and reason (none for answers, the failing stage for failures).")
+REPLY_LATENCY = REGISTRY.histogram(
+    "talkbot_reply_latency_seconds", "Time from a user's message to the bot's reply.", GENERATION_BUCKETS)
+RESPONSE_CACHE = REGISTRY.counter(
+    "talkbot_response_cache_total", "Response cache lookups by result (hit or miss).")
+RESPONSE_CACHE_SIZE = REGISTRY.gauge(
+    "talkbot_response_cache_entries", "Answers currently held in the response cache.")
+WORKER_RESTARTS = REGISTRY.counter(
+    "talkbot_worker_restarts_total", "Processing tasks restarted by the supervisor after a crash.")
+DEFERRED = REGISTRY.counter(
+    "talkbot_backpressure_deferred_total", "Conversations left for a later poll because the processing queue was full.")
+HTTP_POOL = REGISTRY.gauge(
+    "talkbot_http_pool", "Connection pool statistics per upstream.")
+SCHEDULER = REGISTRY.gauge(
+    "talkbot_poll_scheduler", "Adaptive poll scheduler state.")
+RATE_LIMIT_WAIT = REGISTRY.gauge(
+    "talkbot_rate_limit_wait_seconds", "Total time calls spent waiting for the rate limiter, per endpoint.")
+BREAKER_OPEN = REGISTRY.gauge(
+    "talkbot_circuit_open", "1 while the circuit breaker of a service is open.")
+
+
+class MetricsServer:
+
+    def __init__(self, registry: Registry = REGISTRY, host: str = "127.0.0.1", port: int = 9100, path: str = "/metrics"):
+        self.registry: Registry = registry
+        self.host: str = host
+        self.port: int = port
+        self.path: str = path
+        self.runner = None
+
+    async def start(self) -> int:
+        # aiohttp is only imported when the endpoint is actually served
+        from aiohttp import web
+
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8",
+                                headers={"X-Content-Type-Options": "nosniff"})
+
+        app = web.Application()
+        app.router.add_get(self.path, handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        log.info(f"[Metrics] Serving metrics on {self.host}:{self.port}{self.path}")
+        return self.port
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
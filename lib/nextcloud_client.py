@@ -1,93 +1,183 @@
-import ollama
-import time
 import asyncio
+import time
 
-from nc_py_api import AsyncNextcloud, NextcloudException, FsNode 
-from httpx import Limits, Timeout, AsyncClient, HTTPTransport
+from nc_py_api import AsyncNextcloud, NextcloudException
+from httpx import AsyncClient
 from nc_py_api.talk import TalkMessage, Conversation,MessageReactions
 from typing import List, Any, Optional
-from simple_logger import Logger
+from lib.log_sink import get_logger
 from lib.config import Config
-from lib.constants import REACTIONS
-from lib.retry import retry_async, retry_sync
+from lib.message_cache import MessageCache
+from lib.conversation_cache import ConversationIndex
+from lib.reaction_manager import ReactionManager
+from lib.http_pool import HttpClients
+from lib.state_store import StateStore
+from lib.retry import retry_async
 
-log = Logger()
+log = get_logger()
 
 class NextcloudClient:
 
-    def __init__(self) -> None:
-        self.conf = Config()
+    def __init__(self, http: Optional[HttpClients] = None, state: Optional[StateStore] = None, conf: Optional[Config] = None) -> None:
+        self.conf = conf or Config()
         self.url = self.conf.NEXTCLOUD_URL
         self.username = self.conf.NEXTCLOUD_USERNAME
         self.password = self.conf.NEXTCLOUD_PASSWORD
         self.max_retries: int = int(self.conf.NEXTCLOUD_MAX_RETRIES)
         self.retry_delay: int = int(self.conf.NEXTCLOUD_RETRY_DELAY)
+        self.history_limit: int = int(self.conf.NEXTCLOUD_HISTORY_LIMIT)
         self.nc: Optional[AsyncNextcloud] = None
-
-        self.client: AsyncClient = AsyncClient(
-            transport=HTTPTransport(retries=5, verify=False),
-            limits=Limits(max_connections=10, max_keepalive_connections=5),
-            timeout=Timeout(10.0, connect=5.0),
+        self.message_cache: MessageCache = MessageCache(
+            max_conversations=int(self.conf.NEXTCLOUD_MESSAGE_CACHE_SIZE),
+            max_messages=self.history_limit
         )
-
-        log.info("[Nextcloud] Connecting to Nextcloud...")
-        self.connect_nextcloud()
-
-    @retry_sync()
-    def connect_nextcloud(self) -> None:
-        log.info("[Nextcloud] Attempting connection...")
-        self.nc = AsyncNextcloud(
-            nextcloud_url=self.url,
-            nc_auth_user=self.username,
-            nc_auth_pass=self.password,
-            client=self.client
+        self.reactions: ReactionManager = ReactionManager(
+            self, coalesce_window=float(self.conf.NEXTCLOUD_REACTION_WINDOW), state=state
         )
-        log.info("[Nextcloud] Connected to Nextcloud.")
-
-    @retry_async(exceptions=(NextcloudException,))
-    async def retrieve_conversation_by_id(self, conversation_id: int) -> Conversation:
-        return next((conv for conv in await self.nc.talk.get_user_conversations() if conv.conversation_id == conversation_id), None)
+        self.conversations: ConversationIndex = ConversationIndex(
+            ttl=float(self.conf.NEXTCLOUD_CONVERSATION_TTL),
+            full_refresh_interval=float(self.conf.NEXTCLOUD_CONVERSATION_FULL_REFRESH),
+            state=state,
+            on_remove=self.forget_conversation
+        )
+        self._conversations_lock: asyncio.Lock = asyncio.Lock()
+
+        self.http: HttpClients = http or HttpClients(self.conf)
+        self.client: AsyncClient = self.http.nextcloud_client()
+
+    async def connect(self) -> None:
+        # no request is made here; the first poll doubles as the connection check and is retried like any other
+        if self.nc is None:
+            self.nc = AsyncNextcloud(
+                nextcloud_url=self.url,
+                nc_auth_user=self.username,
+                nc_auth_pass=self.password,
+                client=self.client
+            )
+            log.info("[Nextcloud] Client ready for %s.", self.url)
+
+    def forget_conversation(self, conversation_id: int) -> None:
+        self.reactions.forget(conversation_id)
+        self.message_cache.invalidate(conversation_id)
+
+    async def retrieve_conversation_by_id(self, conversation_id: int, fresh: bool = False) -> Conversation:
+        if fresh or self.conversations.is_stale() or conversation_id not in self.conversations:
+            await self.refresh_conversations()
+        return self.conversations.get(conversation_id)
+
+    async def retrieve_conversation_by_token(self, token: str, fresh: bool = False) -> Optional[Conversation]:
+        if fresh or self.conversations.is_stale() or self.conversations.get_by_token(token) is None:
+            await self.refresh_conversations()
+        return self.conversations.get_by_token(token)
+
+    async def refresh_conversations(self) -> None:
+        requested_at = time.monotonic()
+        async with self._conversations_lock:
+            # another caller refreshed while we were waiting for the lock
+            if self.conversations.refreshed_at >= requested_at:
+                return
+            if self.conversations.needs_full_refresh():
+                await self.get_user_conversations()
+            else:
+                # our own cursor rather than the library's, so it survives restarts and is only advanced once merged
+                await self.get_user_conversations(modified_since=self.conversations.cursor)
+
+    async def get_changed_conversations(self) -> List[Conversation]:
+        await self.refresh_conversations()
+        return self.conversations.drain_changed()
+
+    async def get_unread_conversations(self, conversation_types: tuple = ("ONE_TO_ONE",)) -> List[Conversation]:
+        await self.refresh_conversations()
+        return self.conversations.drain_unread(conversation_types)
 
-    @retry_async(exceptions=(NextcloudException,))
     async def retrieve_message_by_id(self, conversation_id: int, message_id: int) -> TalkMessage:
-        conversation = await self.retrieve_conversation_by_id(conversation_id)
-        messages = await self.nc.talk.receive_messages(conversation=conversation, look_in_future=False, limit=200)
-        return next(message for message in messages if message.message_id == message_id)
-
-    @retry_async(exceptions=(NextcloudException,))
-    async def receive_messages(self, conversation: Conversation, look_in_future=False):
-        return await self.nc.talk.receive_messages(conversation=conversation, look_in_future=look_in_future, limit=200)
+        message = self.message_cache.find(conversation_id, message_id)
+        if message is None:
+            messages = await self.retrieve_conversation_history(conversation_id)
+            message = next(message for message in messages if message.message_id == message_id)
+        return message
+
+    async def _chat(self, method: str, conversation: Conversation, path: str = "", **kwargs) -> Any:
+        # nc_py_api has no public call for lastKnownMessageId, setReadMarker or edits, so the chat endpoint is
+        # reached through its private session here, and only here
+        return await self.nc._session.ocs(method, f"{self.nc.talk._ep_base}/api/v1/chat/{conversation.token}{path}", **kwargs)
+
+    async def _fetch_messages(self, conversation: Conversation, **params) -> List[TalkMessage]:
+        # fetching never moves the read marker, whichever path runs; it only advances when the bot posts
+        params.update({"limit": self.history_limit, "timeout": 0, "setReadMarker": 0, "noStatusUpdate": 1})
+        try:
+            result = await self._chat("GET", conversation, params=params)
+        except NextcloudException as e:
+            if e.status_code == 304:
+                return []
+            raise
+        except ValueError:
+            # Talk answers 304 with an empty body when there is nothing to return
+            return []
+        return [TalkMessage(i) for i in result]
+
+    @retry_async(exceptions=(NextcloudException,), endpoint="nextcloud.messages")
+    async def receive_messages(self, conversation: Conversation) -> List[TalkMessage]:
+        return await self._fetch_messages(conversation, lookIntoFuture=0)
+
+    @retry_async(exceptions=(NextcloudException,), endpoint="nextcloud.messages")
+    async def receive_messages_since(self, conversation: Conversation, last_known_message_id: int) -> List[TalkMessage]:
+        return await self._fetch_messages(conversation, lookIntoFuture=1, lastKnownMessageId=last_known_message_id)
 
-    @retry_async(exceptions=(NextcloudException,))
     async def retrieve_conversation_history(self, conversation_id: int) -> List[TalkMessage]:
-        log.info(f"[Nextcloud] Retrieving messages for conversation {conversation_id}")
         conversation = await self.retrieve_conversation_by_id(conversation_id)
         if conversation:
-            messages = await self.receive_messages(conversation=conversation, look_in_future=False)
-            if messages:
-                log.info(f"[Nextcloud] Retrieved {len(messages)} messages.")
-                return messages
+            cached = self.message_cache.get(conversation_id)
+            if cached is None:
+                messages = await self.receive_messages(conversation=conversation)
+                if messages:
+                    self.message_cache.seed(conversation_id, messages)
+                    log.debug("[Nextcloud] Retrieved %d messages.", len(messages))
+                    return messages
+            else:
+                new_messages = await self.receive_messages_since(conversation, cached.last_known_id)
+                while new_messages:
+                    self.message_cache.merge(conversation_id, new_messages)
+                    if len(new_messages) < self.history_limit:
+                        break
+                    new_messages = await self.receive_messages_since(conversation, cached.last_known_id)
+                messages = cached.newest_first()
+                if messages:
+                    log.debug("[Nextcloud] Retrieved %d messages (%d latest known).", len(messages), cached.last_known_id)
+                    return messages
         log.warning(f"[Nextcloud] No messages found for conversation {conversation_id}")
         return []
 
-    @retry_async()
+    @retry_async(endpoint="nextcloud.send")
     async def reply_to_conversation(self, conversation: Conversation, message: str) -> bool:
-        log.info(f"[Nextcloud] Replying to conversation {conversation.conversation_id} with message: {message}")
         if conversation:
             await self.nc.talk.send_message(conversation=conversation, message=message)
-            log.info(f"[Nextcloud] Replied to conversation {conversation.conversation_id}.")
+            log.debug("[Nextcloud] Replied to conversation %d (%d chars).", conversation.conversation_id, len(message))
             return True
         log.warning(f"[Nextcloud] Conversation not found")
         return False
 
-    @retry_async()
+    @retry_async(endpoint="nextcloud.send")
+    async def send_message(self, conversation: Conversation, message: str) -> TalkMessage:
+        return await self.nc.talk.send_message(conversation=conversation, message=message)
+
+    @retry_async(exceptions=(NextcloudException,), endpoint="nextcloud.send")
+    async def edit_message(self, conversation: Conversation, message: TalkMessage, text: str) -> TalkMessage:
+        result = await self._chat("PUT", conversation, f"/{message.message_id}", json={"message": text})
+        return TalkMessage(result)
+
+    @retry_async(endpoint="nextcloud.conversations")
     async def get_user_conversations(self, no_status_update: bool = True, include_status: bool = False, modified_since: int | bool = 0) -> list[Conversation]:
-        log.info("[Nextcloud] Retrieving user conversations...")
         conversations = await self.nc.talk.get_user_conversations(no_status_update=no_status_update, include_status=include_status, modified_since=modified_since)
+        cursor = self.nc.talk.modified_since
+        if modified_since:
+            self.conversations.merge(conversations, cursor)
+        else:
+            self.conversations.replace(conversations, cursor)
         if conversations:
-            log.info(f"[Nextcloud] Retrieved {len(conversations)} conversations.")
+            log.debug("[Nextcloud] Retrieved %d conversations.", len(conversations))
             return conversations
-        log.info("[Nextcloud] No conversations found.")
+        log.debug("[Nextcloud] No conversations found.")
         return []
 
     async def get_last_message(self, conv: Conversation) -> TalkMessage:
@@ -96,23 +186,22 @@ class NextcloudClient:
     async def set_message_unread(self, conversation_id: int, message_id: int):
         pass  # TODO to be implemented
 
-    @retry_async()
     async def set_reaction(self, conversation: Conversation, message: TalkMessage, reaction: Optional[str] = None) -> bool:
-        conversation = await self.retrieve_conversation_by_id(conversation.conversation_id)
-        message = await self.retrieve_message_by_id(conversation_id=conversation.conversation_id, message_id=message.message_id)
-        reactions_dict = await self.nc.talk.get_message_reactions(conversation=conversation, message=message)
-        for emoji, reacts in reactions_dict.items():
-            if emoji in REACTIONS.values():
-                for react in reacts:
-                    if react.actor_id == self.username:
-                        await self.nc.talk.delete_reaction(conversation=conversation, message=message, reaction=emoji)
-        if reaction not in [None, REACTIONS.get("DELETE")]:
-            await self.nc.talk.react_to_message(conversation=conversation, message=message, reaction=reaction)
-        return True
+        return await self.reactions.set(conversation=conversation, message=message, reaction=reaction)
 
-    @retry_async()
     async def clear_reactions(self, conversation: Conversation) -> bool:
-        for message in await self.receive_messages(conversation=conversation, look_in_future=False):
-            if len(message.reactions) != 0:
-                await self.set_reaction(conversation=conversation, message=message, reaction=REACTIONS.get("DELETE"))
+        await self.reactions.clear(conversation=conversation)
         return True
+
+    @retry_async(exceptions=(NextcloudException,), endpoint="nextcloud.reactions")
+    async def add_reaction(self, conversation: Conversation, message_id: int, reaction: str) -> None:
+        await self.nc.talk.react_to_message(message=message_id, reaction=reaction, conversation=conversation)
+
+    @retry_async(exceptions=(NextcloudException,), endpoint="nextcloud.reactions")
+    async def delete_reaction(self, conversation: Conversation, message_id: int, reaction: str) -> None:
+        try:
+            await self.nc.talk.delete_reaction(message=message_id, reaction=reaction, conversation=conversation)
+        except NextcloudException as e:
+            # already gone, e.g. removed by hand in the Talk UI
+            if e.status_code != 404:
+                raise
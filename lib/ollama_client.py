@@ -1,45 +1,118 @@
 import asyncio
+import time
 
-from ollama import AsyncClient, Message, GenerateResponse, ChatResponse
-from nc_py_api.talk import TalkMessage
-from typing import Optional, List
-from simple_logger import Logger
+from ollama import Message, GenerateResponse, ChatResponse
+from typing import Optional, List, AsyncIterator
+from lib.log_sink import get_logger
 from lib.config import Config
-from datetime import datetime
-from lib.retry import retry_sync,retry_async
+from lib.retry import retry_async
+from lib.resilience import RetryableError
+from lib.ollama_pool import OllamaBackend, OllamaPool
+from lib.http_pool import HttpClients
+from lib.metrics import OLLAMA_DURATION, OLLAMA_TOKENS
 
-log = Logger()
+log = get_logger()
 
 class OllamaChat:
 
-    def __init__(self):
-        self.conf = Config()
+    def __init__(self, http: Optional[HttpClients] = None, conf: Optional[Config] = None):
+        self.conf = conf or Config()
+        self.http: HttpClients = http or HttpClients(self.conf)
         self.host = self.conf.OLLAMA_HOST
         self.model = self.conf.OLLAMA_MODEL
         self.system_prompt = self.conf.OLLAMA_SYSTEM_PROMPT
         self.assistant_id = self.conf.OLLAMA_ACTOR_ID
-        self.client = AsyncClient(host=self.host)
+        self.stream: bool = bool(int(self.conf.OLLAMA_STREAM))
+        # identical options and keep_alive on every request, otherwise Ollama reloads the model and drops its KV cache
+        self.keep_alive: str = self.conf.OLLAMA_KEEP_ALIVE
+        self.options: Optional[dict] = {"num_ctx": int(self.conf.OLLAMA_NUM_CTX)} if int(self.conf.OLLAMA_NUM_CTX) else None
+        backend_specs = [spec for spec in self.conf.OLLAMA_BACKENDS.split(",") if spec.strip()] or [self.host]
+        self.pool = OllamaPool(
+            [OllamaBackend.parse(spec, default_concurrency=int(self.conf.OLLAMA_BACKEND_CONCURRENCY), **self.http.ollama_client_kwargs()) for spec in backend_specs],
+            probe_interval=float(self.conf.OLLAMA_HEALTH_INTERVAL),
+            eject_seconds=float(self.conf.OLLAMA_EJECT_SECONDS))
+        self.client = self.pool.backends[0].client
         self.max_retries: int = int(self.conf.NEXTCLOUD_MAX_RETRIES)
         self.retry_delay: int = int(self.conf.NEXTCLOUD_RETRY_DELAY)
         log.info(f"[Ollama] Initialized with model: {self.model}")
 
+    @property
+    def capacity(self) -> int:
+        # generations the backends serving the model can run at once
+        return sum(backend.max_concurrency for backend in self.pool.backends if backend.serves(self.model)) or 1
+
     @retry_async()
-    async def send_message_chat(self, messages: List[Message]) -> ChatResponse:
-                response: ChatResponse = await self.client.chat(messages=messages, model=self.model)
+    async def send_message_chat(self, messages: List[Message], prompt_tokens: Optional[int] = None, affinity_key: Optional[int] = None) -> ChatResponse:
+                response: ChatResponse = await self.pool.run(
+                    self.model,
+                    lambda client: client.chat(messages=messages, model=self.model, options=self.options, keep_alive=self.keep_alive),
+                    affinity_key=affinity_key)
+                self.log_prompt_cache(response, prompt_tokens)
+                self.observe_response(response)
                 response_content = response.message.content if response.message else "No response received."
                 if response_content not in [None,'']:
-                    log.info("[Ollama] Response correctly received.")
+                    log.debug("[Ollama] Response correctly received.")
                     return response_content #type:ignore
                 else:
-                    raise RuntimeError("Ollama returned an invalid response")
+                    raise RetryableError("Ollama returned an invalid response")
     
+    async def stream_message_chat(self, messages: List[Message], prompt_tokens: Optional[int] = None, affinity_key: Optional[int] = None) -> AsyncIterator[str]:
+                chunks = self.pool.stream(
+                    self.model,
+                    lambda client: client.chat(messages=messages, model=self.model, stream=True, options=self.options, keep_alive=self.keep_alive),
+                    affinity_key=affinity_key)
+                async for chunk in chunks:
+                    if chunk.message and chunk.message.content:
+                        yield chunk.message.content
+                    if chunk.done:
+                        self.log_prompt_cache(chunk, prompt_tokens)
+                        self.observe_response(chunk)
+                        log.debug("[Ollama] Streamed response correctly received.")
+
+    async def warm_up(self) -> float:
+                # an empty generate request only loads the model; same options and keep_alive as real requests,
+                # otherwise the first chat would reload it
+                started = time.monotonic()
+                backends = [backend for backend in self.pool.backends if backend.serves(self.model)]
+                results = await asyncio.gather(
+                    *(backend.client.generate(model=self.model, options=self.options, keep_alive=self.keep_alive)
+                      for backend in backends),
+                    return_exceptions=True)
+                for backend, result in zip(backends, results):
+                    if isinstance(result, Exception):
+                        log.warning(f"[Ollama] Could not preload {self.model} on {backend.host}: {result}")
+                elapsed = time.monotonic() - started
+                log.info("[Ollama] Preloaded %s on %d backend(s) in %.0fms.", self.model, len(backends), elapsed * 1000)
+                return elapsed
+
+    def log_prompt_cache(self, response: ChatResponse, prompt_tokens: Optional[int] = None) -> None:
+                evaluated = response.prompt_eval_count or 0
+                if prompt_tokens:
+                    reused = max(0.0, 1 - evaluated / prompt_tokens)
+                    log.info("[Ollama] Prompt eval %d of ~%d tokens (~%.0f%% reused from KV cache), generated %d.",
+                             evaluated, prompt_tokens, reused * 100, response.eval_count or 0)
+                else:
+                    log.info("[Ollama] Prompt eval %d tokens, generated %d.", evaluated, response.eval_count or 0)
+
+    def observe_response(self, response: ChatResponse) -> None:
+                OLLAMA_TOKENS.inc(response.prompt_eval_count or 0, phase="prompt", model=self.model)
+                OLLAMA_TOKENS.inc(response.eval_count or 0, phase="eval", model=self.model)
+                # Ollama reports durations in nanoseconds
+                for phase, duration in (("load", response.load_duration),
+                                        ("prompt", response.prompt_eval_duration),
+                                        ("eval", response.eval_duration),
+                                        ("total", response.total_duration)):
+                    if duration:
+                        OLLAMA_DURATION.observe(duration / 1e9, phase=phase, model=self.model)
+
     @retry_async()
     async def send_message_generate(self, message: str) -> GenerateResponse:
                 log.debug("[Ollama] Sending message via /generate...")
-                response: GenerateResponse = await self.client.generate(model=self.model, prompt=message)
+                response: GenerateResponse = await self.pool.run(
+                    self.model,
+                    lambda client: client.generate(model=self.model, prompt=message, options=self.options, keep_alive=self.keep_alive))
                 result = response.response if response.response else "No response received."
-                log.info("[Ollama] Response correctly received.")
-                log.debug("[Ollama] Response received: " + result)
+                log.debug("[Ollama] Response received: %s", result)
                 return result #type:ignore
         
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from ollama import AsyncClient
+from lib.log_sink import get_logger
+from lib.resilience import is_retryable
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, List, Optional
+
+log = get_logger()
+
+
+class OllamaBackend:
+
+    def __init__(self, host: str, max_concurrency: int = 1, models: Optional[List[str]] = None, **client_kwargs):
+        self.host: str = host
+        self.max_concurrency: int = max(1, max_concurrency)
+        self.models: set = set(models or [])
+        self.client: AsyncClient = AsyncClient(host=host, **client_kwargs)
+        self.outstanding: int = 0
+        self.failures: int = 0
+        self.ejected_until: float = 0.0
+        self.slots: asyncio.Semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def serves(self, model: str) -> bool:
+        return not self.models or model in self.models
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    @property
+    def load(self) -> float:
+        return self.outstanding / self.max_concurrency
+
+    def __repr__(self) -> str:
+        return f"<OllamaBackend {self.host} outstanding={self.outstanding}/{self.max_concurrency} healthy={self.healthy}>"
+
+    @classmethod
+    def parse(cls, spec: str, default_concurrency: int = 1, **client_kwargs) -> "OllamaBackend":
+        # host[|max_concurrency[|model+model...]]
+        host, _, rest = spec.strip().partition("|")
+        concurrency, _, models = rest.partition("|")
+        return cls(host,
+                   max_concurrency=int(concurrency) if concurrency else default_concurrency,
+                   models=[model for model in models.split("+") if model],
+                   **client_kwargs)
+
+
+class OllamaPool:
+
+    def __init__(self,
+                 backends: List[OllamaBackend],
+                 probe_interval: float = 15.0,
+                 eject_after: int = 2,
+                 eject_seconds: float = 30.0,
+                 max_affinity: int = 5000):
+        if not backends:
+            raise ValueError("OllamaPool needs at least one backend")
+        self.backends: List[OllamaBackend] = backends
+        self.probe_interval: float = probe_interval
+        self.eject_after: int = eject_after
+        self.eject_seconds: float = eject_seconds
+        self.max_affinity: int = max_affinity
+        # backend that last served a conversation, which most likely still holds its KV cache
+        self._affinity: "OrderedDict[Hashable, OllamaBackend]" = OrderedDict()
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def pick(self, model: str, affinity_key: Optional[Hashable] = None, exclude: tuple = ()) -> OllamaBackend:
+        serving = [backend for backend in self.backends if backend.serves(model) and backend not in exclude]
+        if not serving:
+            raise RuntimeError(f"No Ollama backend left for model {model}")
+        # with every host ejected, trying one is still better than failing outright
+        candidates = [backend for backend in serving if backend.healthy] or serving
+
+        preferred = self._affinity.get(affinity_key) if affinity_key is not None else None
+        if preferred in candidates and preferred.outstanding < preferred.max_concurrency:
+            return preferred
+        return min(candidates, key=lambda backend: (backend.load, backend.outstanding))
+
+    async def run(self,
+                  model: str,
+                  call: Callable[[AsyncClient], Awaitable[Any]],
+                  affinity_key: Optional[Hashable] = None) -> Any:
+        tried: tuple = ()
+        while True:
+            backend = self.pick(model, affinity_key, exclude=tried)
+            backend.outstanding += 1
+            try:
+                async with backend.slots:
+                    result = await call(backend.client)
+            except Exception as e:
+                # a 4xx is about the request (bad prompt, unknown model), not the host, so it neither ejects nor fails over
+                if not is_retryable(e):
+                    raise
+                self._record_failure(backend, e)
+                tried += (backend,)
+                if len(tried) >= len(self.backends):
+                    raise
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._record_success(backend, affinity_key)
+            return result
+
+    async def stream(self,
+                     model: str,
+                     call: Callable[[AsyncClient], Awaitable[AsyncIterator[Any]]],
+                     affinity_key: Optional[Hashable] = None) -> AsyncIterator[Any]:
+        tried: tuple = ()
+        while True:
+            backend = self.pick(model, affinity_key, exclude=tried)
+            backend.outstanding += 1
+            started = False
+            try:
+                async with backend.slots:
+                    async for chunk in await call(backend.client):
+                        started = True
+                        yield chunk
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self._record_failure(backend, e)
+                tried += (backend,)
+                # once text reached the user the stream cannot be replayed elsewhere
+                if started or len(tried) >= len(self.backends):
+                    raise
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._record_success(backend, affinity_key)
+            return
+
+    async def probe(self) -> None:
+        async def check(backend: OllamaBackend) -> None:
+            try:
+                await asyncio.wait_for(backend.client.ps(), timeout=5.0)
+            except Exception as e:
+                self._record_failure(backend, e)
+            else:
+                if not backend.healthy or backend.failures:
+                    log.info(f"[Ollama] Backend {backend.host} is healthy again.")
+                backend.failures = 0
+                backend.ejected_until = 0.0
+
+        await asyncio.gather(*(check(backend) for backend in self.backends))
+
+    def start_health_checks(self) -> None:
+        if self._probe_task is None:
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop_health_checks(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+            self._probe_task = None
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.probe_interval)
+
+    def _record_success(self, backend: OllamaBackend, affinity_key: Optional[Hashable]) -> None:
+        backend.failures = 0
+        if affinity_key is not None:
+            self._affinity[affinity_key] = backend
+            self._affinity.move_to_end(affinity_key)
+            if len(self._affinity) > self.max_affinity:
+                self._affinity.popitem(last=False)
+
+    def _record_failure(self, backend: OllamaBackend, error: Exception) -> None:
+        backend.failures += 1
+        log.warning(f"[Ollama] Backend {backend.host} failed ({backend.failures}x): {error}")
+        if backend.failures >= self.eject_after and backend.healthy:
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+            log.warning(f"[Ollama] Ejecting backend {backend.host} for {self.eject_seconds:.0f}s.")
@@ -0,0 +1,92 @@
+import asyncio
+
+from nc_py_api.talk import Conversation, TalkMessage
+from lib.log_sink import get_logger
+from typing import Dict, Optional, Tuple
+from lib.constants import REACTIONS
+from lib.state_store import StateStore
+
+log = get_logger()
+
+ReactionKey = Tuple[int, int]
+
+
+class ReactionManager:
+
+    def __init__(self, nc_bot, coalesce_window: float = 1.0, state: Optional[StateStore] = None):
+        self.nc_bot = nc_bot
+        self.coalesce_window: float = coalesce_window
+        self.state: Optional[StateStore] = state
+        # status emoji the bot currently has on a message, per conversation, so clearing one room stays cheap
+        self.applied: Dict[int, Dict[int, str]] = {}
+        for (conversation_id, message_id), emoji in (state.load_reactions() if state else {}).items():
+            self.applied.setdefault(conversation_id, {})[message_id] = emoji
+        self.pending: Dict[ReactionKey, Tuple[Conversation, int, str]] = {}
+        self._tasks: Dict[ReactionKey, asyncio.Task] = {}
+
+    async def set(self, conversation: Conversation, message: TalkMessage, reaction: Optional[str] = None) -> bool:
+        key = (conversation.conversation_id, message.message_id)
+        if message.message_id not in self.applied.get(conversation.conversation_id, {}):
+            self._seed(key, message)
+        self.pending[key] = (conversation, message.message_id, reaction or REACTIONS.get("DELETE"))
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._flush_later(key))
+        return True
+
+    async def clear(self, conversation: Conversation) -> None:
+        for message_id in list(self.applied.get(conversation.conversation_id, ())):
+            key = (conversation.conversation_id, message_id)
+            if key not in self.pending:
+                self.pending[key] = (conversation, message_id, REACTIONS.get("DELETE"))
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.create_task(self._flush_later(key))
+
+    def forget(self, conversation_id: int) -> None:
+        # the bot left the room or it was deleted: there is nothing left to clear there
+        for message_id in self.applied.pop(conversation_id, {}):
+            if self.state:
+                self.state.record_reaction(conversation_id, message_id, None)
+
+    async def flush(self) -> None:
+        await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+
+    def _seed(self, key: ReactionKey, message: TalkMessage) -> None:
+        # reactionsSelf comes with every message we already hold, so no extra request is needed
+        statuses = [emoji for emoji in message.reactions_self if emoji in REACTIONS.values()]
+        if statuses:
+            self.applied.setdefault(key[0], {})[key[1]] = statuses[0]
+
+    async def _flush_later(self, key: ReactionKey) -> None:
+        await asyncio.sleep(self.coalesce_window)
+        while key in self.pending:
+            conversation, message_id, target = self.pending.pop(key)
+            try:
+                await self._apply(conversation, message_id, target)
+            except Exception as e:
+                log.warning(f"[Reactions] Could not update reaction on message {message_id}: {e}")
+        self._tasks.pop(key, None)
+
+    async def _apply(self, conversation: Conversation, message_id: int, target: str) -> None:
+        key = (conversation.conversation_id, message_id)
+        current = self.applied.get(conversation.conversation_id, {}).get(message_id)
+        if current == target or (current is None and not target):
+            return
+        if current:
+            await self.nc_bot.delete_reaction(conversation, message_id, current)
+            self._discard(key)
+            if self.state:
+                self.state.record_reaction(*key, None)
+        if target:
+            await self.nc_bot.add_reaction(conversation, message_id, target)
+            self.applied.setdefault(conversation.conversation_id, {})[message_id] = target
+            if self.state:
+                self.state.record_reaction(*key, target)
+
+    def _discard(self, key: ReactionKey) -> None:
+        conversation_id, message_id = key
+        statuses = self.applied.get(conversation_id)
+        if statuses is not None:
+            statuses.pop(message_id, None)
+            # rooms drop out once their last status is gone, so the map only holds rooms with visible statuses
+            if not statuses:
+                del self.applied[conversation_id]
@@ -0,0 +1,190 @@
+import asyncio
+import time
+
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class RetryableError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+
+    def __init__(self, name: str, retry_in: float) -> None:
+        super().__init__(f"circuit '{name}' is open, retry in {retry_in:.1f}s")
+        self.name: str = name
+        self.retry_in: float = retry_in
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, CircuitOpenError):
+        return False
+    # HTTP-level failures from nc_py_api (NextcloudException), ollama (ResponseError) and httpx
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int) and status > 0:
+        return status in (408, 425, 429) or status >= 500
+    if isinstance(error, (RetryableError, asyncio.TimeoutError, TimeoutError, ConnectionError, OSError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate: float = rate
+        self.capacity: float = max(capacity, 1.0)
+        self.tokens: float = self.capacity
+        self.updated: float = time.monotonic()
+        self.waited: float = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            delay = (1 - self.tokens) / self.rate
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    CLOSED: str = "closed"
+    OPEN: str = "open"
+    HALF_OPEN: str = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, cooldown: float = 30.0) -> None:
+        self.name: str = name
+        self.failure_threshold: int = failure_threshold
+        self.cooldown: float = cooldown
+        self.state: str = self.CLOSED
+        self.failures: int = 0
+        self.opened_at: float = 0.0
+        self._probing: bool = False
+
+    def before_call(self) -> None:
+        if self.state == self.CLOSED:
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == self.OPEN and elapsed >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        # half-open lets exactly one request through to test the service
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        raise CircuitOpenError(self.name, max(0.0, self.cooldown - elapsed))
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def record_error(self, error: BaseException) -> None:
+        # every outcome has to settle a half-open probe, or the breaker stays open forever
+        if isinstance(error, asyncio.CancelledError):
+            self._probing = False
+        elif is_retryable(error):
+            self.record_failure()
+        elif isinstance(getattr(error, "status_code", None), int) or getattr(error, "response", None) is not None:
+            # the service answered, it just did not like the request
+            self.record_success()
+        else:
+            self._probing = False
+
+
+class RetryBudget:
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, window: float = 10.0) -> None:
+        # retries may add at most `ratio` on top of the requests seen in the window
+        self.ratio: float = ratio
+        self.min_per_second: float = min_per_second
+        self.window: float = window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self.exhausted: int = 0
+
+    def _trim(self, now: float) -> None:
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self) -> None:
+        self._requests.append(time.monotonic())
+
+    def try_retry(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        allowed = self.ratio * len(self._requests) + self.min_per_second * self.window
+        if len(self._retries) < allowed:
+            self._retries.append(now)
+            return True
+        self.exhausted += 1
+        return False
+
+
+class Resilience:
+
+    def __init__(self,
+                 rate: float = 10.0,
+                 burst: float = 20.0,
+                 failure_threshold: int = 5,
+                 cooldown: float = 30.0,
+                 budget_ratio: float = 0.2) -> None:
+        self.rate: float = rate
+        self.burst: float = burst
+        self.failure_threshold: int = failure_threshold
+        self.cooldown: float = cooldown
+        self.budget: RetryBudget = RetryBudget(ratio=budget_ratio)
+        self.limiters: Dict[str, TokenBucket] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def limiter(self, endpoint: str) -> TokenBucket:
+        if endpoint not in self.limiters:
+            self.limiters[endpoint] = TokenBucket(self.rate, self.burst)
+        return self.limiters[endpoint]
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        # endpoint classes of one service ("nextcloud.messages", "nextcloud.reactions") share a breaker
+        service = endpoint.split(".", 1)[0]
+        if service not in self.breakers:
+            self.breakers[service] = CircuitBreaker(service, self.failure_threshold, self.cooldown)
+        return self.breakers[service]
+
+
+_resilience: Optional[Resilience] = None
+
+
+def get_resilience() -> Resilience:
+    global _resilience
+    if _resilience is None:
+        from lib.config import Config
+        conf = Config()
+        _resilience = Resilience(
+            rate=float(conf.NEXTCLOUD_RATE_LIMIT),
+            burst=float(conf.NEXTCLOUD_RATE_BURST),
+            failure_threshold=int(conf.NEXTCLOUD_BREAKER_THRESHOLD),
+            cooldown=float(conf.NEXTCLOUD_BREAKER_COOLDOWN),
+            budget_ratio=float(conf.NEXTCLOUD_RETRY_BUDGET))
+    return _resilience
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+
+from collections import OrderedDict
+from nc_py_api.talk import TalkMessage
+from lib.log_sink import get_logger
+from typing import Iterable, List, Optional, Tuple
+
+log = get_logger()
+
+_PLACEHOLDER = re.compile(r"\{[a-z]+(?:-[\w-]+)?\}")
+_SPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,;:!?¿¡…\"'"
+# part of every key; bumped when what a key covers changes, so older persisted answers are never served
+_KEY_VERSION = 2
+
+
+def normalize(text: str) -> str:
+    # only differences that do not change the question: case, spacing, mention placeholders, end punctuation
+    text = _PLACEHOLDER.sub(" ", text or "")
+    return _SPACE.sub(" ", text).strip(_EDGE_PUNCTUATION).casefold()
+
+
+class ResponseCache:
+
+    def __init__(self,
+                 max_entries: int = 1000,
+                 ttl: float = 86400.0,
+                 messages: int = 1,
+                 path: Optional[str] = None,
+                 excluded: Iterable[str] = ()):
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self.messages: int = max(1, messages)
+        self.path: Optional[str] = path or None
+        # conversation tokens or ids whose answers depend on more than the question
+        self.excluded: frozenset = frozenset(str(item).strip() for item in excluded if str(item).strip())
+        # key -> (stored at, wall clock so entries can outlive a restart; response)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.dirty: bool = False
+        if self.path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def enabled_for(self, conversation) -> bool:
+        return conversation.token not in self.excluded and str(conversation.conversation_id) not in self.excluded
+
+    def window(self, messages: List[TalkMessage]) -> List[TalkMessage]:
+        # an answer may only depend on what its key covers, so rooms using the cache show the model just these
+        return messages[:self.messages]
+
+    def key(self, system_prompt: str, model: str, messages: List[TalkMessage], assistant_id: str) -> Optional[str]:
+        # messages arrive newest first; the newest one has to be a question, not the bot's own answer
+        if not messages or messages[0].actor_id == assistant_id:
+            return None
+        turns = [("assistant" if message.actor_id == assistant_id else "user", normalize(message.message))
+                 for message in reversed(messages)]
+        if not turns[-1][1]:
+            return None
+        payload = json.dumps([_KEY_VERSION, system_prompt, model, turns], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored, response = entry
+        if time.time() - stored > self.ttl:
+            del self._entries[key]
+            self.dirty = True
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def put(self, key: Optional[str], response: str) -> None:
+        if key is None or not response:
+            return
+        self._entries[key] = (time.time(), response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.dirty = True
+
+    def _load(self) -> None:
+        try:
+            with open(self.path) as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning(f"[ResponseCache] Could not read {self.path}, starting empty: {e}")
+            return
+        now = time.time()
+        # the file is written oldest first, so the LRU order survives a restart
+        for key, stored, response in rows[-self.max_entries:]:
+            if now - stored <= self.ttl:
+                self._entries[key] = (stored, response)
+        log.info(f"[ResponseCache] Loaded {len(self._entries)} cached responses from {self.path}.")
+
+    def _write(self, rows: List[Tuple[str, float, str]]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # write-then-rename, so a crash mid-write never leaves a truncated cache behind
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(rows, f, ensure_ascii=False)
+        os.replace(temporary, self.path)
+
+    async def flush(self) -> None:
+        if not self.path or not self.dirty:
+            return
+        self.dirty = False
+        rows = [(key, stored, response) for key, (stored, response) in self._entries.items()]
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            self.dirty = True
+            log.error(f"[ResponseCache] Could not persist cached responses: {e}")
+
+    async def run_flusher(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def close(self) -> None:
+        await self.flush()
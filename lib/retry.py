@@ -1,52 +1,79 @@
 import asyncio
 import functools
-from simple_logger import Logger
+import random
+from lib.log_sink import get_logger
 import time
-from lib.config import Config
+from typing import Optional, Tuple
+from lib.resilience import get_resilience, is_retryable
+from lib.metrics import NEXTCLOUD_LATENCY, RETRIES, RETRY_GIVE_UPS
 
-conf=Config()
-log=Logger()
+log=get_logger()
+
+_defaults: Optional[Tuple[int, float, float]] = None
+
+
+def _retry_defaults() -> Tuple[int, float, float]:
+    # read on the first call rather than at import, so importing a client never loads the configuration
+    global _defaults
+    if _defaults is None:
+        from lib.config import Config
+        conf = Config()
+        _defaults = (int(conf.NEXTCLOUD_MAX_RETRIES), float(conf.NEXTCLOUD_RETRY_DELAY), float(conf.NEXTCLOUD_BACKOFF))
+    return _defaults
 
 def retry_async(
-    max_retries: int = conf.NEXTCLOUD_MAX_RETRIES,
-    base_delay: float = conf.NEXTCLOUD_RETRY_DELAY,
+    max_retries: Optional[int] = None,
+    base_delay: Optional[float] = None,
     exceptions: tuple = (Exception,),
-    backoff: float = conf.NEXTCLOUD_BACKOFF
+    backoff: Optional[float] = None,
+    endpoint: Optional[str] = None
 ):
     def decorator(func):
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
+            default_retries, default_delay, default_backoff = _retry_defaults()
+            attempts = max_retries if max_retries is not None else default_retries
+            delay = base_delay if base_delay is not None else default_delay
+            factor = backoff if backoff is not None else default_backoff
+            resilience = get_resilience()
+            limiter = resilience.limiter(endpoint) if endpoint else None
+            breaker = resilience.breaker(endpoint) if endpoint else None
+            for attempt in range(attempts):
+                # the limiter wait comes first: once a probe is admitted, nothing may stand between it and the call
+                if limiter:
+                    await limiter.acquire()
+                if breaker:
+                    breaker.before_call()
+                resilience.budget.record_request()
+                started = time.monotonic()
                 try:
-                    return await func(*args, **kwargs)
-                except exceptions as e:
-                    log.warning(f"[Retry-Async] Attempt {attempt + 1}/{max_retries} failed for {func}: {e}")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(base_delay * (backoff ** attempt))
+                    if endpoint:
+                        with log.span(endpoint, call=func.__name__, attempt=attempt + 1):
+                            result = await func(*args, **kwargs)
                     else:
-                        log.error(f"[Retry-Async] Gave up {func} after {max_retries} attempts.")
+                        result = await func(*args, **kwargs)
+                except BaseException as e:
+                    if endpoint:
+                        NEXTCLOUD_LATENCY.observe(time.monotonic() - started, method=func.__name__, outcome="error")
+                    # recorded for every error, not just the retried ones, so a half-open probe always resolves
+                    if breaker:
+                        breaker.record_error(e)
+                    if not isinstance(e, exceptions) or not is_retryable(e):
                         raise
-        return wrapper
-    return decorator
-
-def retry_sync(
-    max_retries: int = 3,
-    base_delay: float = 1.0,
-    exceptions: tuple = (Exception,),
-    backoff: float = 2.0
-):
-    def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except exceptions as e:
-                    log.warning(f"[Retry-Sync] Attempt {attempt + 1}/{max_retries} failed for {func}: {e}")
-                    if attempt < max_retries - 1:
-                        time.sleep(base_delay * (backoff ** attempt))
+                    log.warning(f"[Retry-Async] Attempt {attempt + 1}/{attempts} failed for {func}: {e}")
+                    if attempt < attempts - 1 and resilience.budget.try_retry():
+                        RETRIES.inc(call=func.__name__)
+                        # full jitter keeps retries from many workers from landing in lockstep
+                        await asyncio.sleep(random.uniform(0, delay * (factor ** attempt)))
                     else:
-                        log.error(f"[Retry-Sync] Gave up {func} after {max_retries} attempts.")
+                        log.error(f"[Retry-Async] Gave up {func} after {attempt + 1} attempts.")
+                        RETRY_GIVE_UPS.inc(call=func.__name__)
                         raise
+                else:
+                    if endpoint:
+                        NEXTCLOUD_LATENCY.observe(time.monotonic() - started, method=func.__name__, outcome="ok")
+                    if breaker:
+                        breaker.record_success()
+                    return result
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
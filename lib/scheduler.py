@@ -0,0 +1,52 @@
+import random
+
+from typing import Dict
+
+
+class PollScheduler:
+
+    def __init__(self,
+                 min_interval: float = 1.0,
+                 max_interval: float = 60.0,
+                 initial_interval: float = 5.0,
+                 backoff: float = 2.0,
+                 jitter: float = 0.1):
+        self.min_interval: float = min_interval
+        self.max_interval: float = max(max_interval, min_interval)
+        self.backoff: float = backoff
+        self.jitter: float = jitter
+        self.current_interval: float = min(max(initial_interval, self.min_interval), self.max_interval)
+        self.last_sleep: float = self.current_interval
+        self.polls: int = 0
+        self.active_polls: int = 0
+        self.idle_streak: int = 0
+
+    def record(self, unread: int = 0, in_flight: int = 0) -> float:
+        self.polls += 1
+        if unread > 0 or in_flight > 0:
+            self.active_polls += 1
+            self.idle_streak = 0
+            # a burst of new messages snaps straight to the fastest cadence,
+            # in-flight work alone only halves the interval
+            if unread > 0:
+                self.current_interval = self.min_interval
+            else:
+                self.current_interval = max(self.min_interval, self.current_interval / 2)
+        else:
+            self.idle_streak += 1
+            self.current_interval = min(self.max_interval, self.current_interval * self.backoff)
+        return self.current_interval
+
+    def next_sleep(self) -> float:
+        spread = self.current_interval * self.jitter
+        self.last_sleep = max(0.0, self.current_interval + random.uniform(-spread, spread))
+        return self.last_sleep
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "current_interval": self.current_interval,
+            "last_sleep": self.last_sleep,
+            "polls": self.polls,
+            "active_polls": self.active_polls,
+            "idle_streak": self.idle_streak,
+        }
@@ -0,0 +1,201 @@
+import asyncio
+import bisect
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from lib.log_sink import get_logger
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, Type
+
+log = get_logger()
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def default_instance_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class HashRing:
+
+    def __init__(self, members: List[str], vnodes: int = 64):
+        self.members: Tuple[str, ...] = tuple(sorted(set(members)))
+        self.vnodes: int = vnodes
+        # virtual nodes spread each member over the ring, so a join or leave moves ~1/N of the keys
+        points = sorted((_hash(f"{member}#{index}"), member) for member in self.members for index in range(vnodes))
+        self._hashes: List[int] = [point for point, _ in points]
+        self._owners: List[str] = [member for _, member in points]
+
+    def owner(self, key: Hashable) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._owners[index]
+
+
+class LeaseBackend:
+
+    def renew(self, member: str, ttl: float) -> None:
+        raise NotImplementedError
+
+    def alive(self) -> List[str]:
+        raise NotImplementedError
+
+    def release(self, member: str) -> None:
+        raise NotImplementedError
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS leases (member TEXT PRIMARY KEY, expires REAL NOT NULL)")
+        self._lock: threading.Lock = threading.Lock()
+
+    def renew(self, member: str, ttl: float) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO leases VALUES (?, ?)", (member, time.time() + ttl))
+
+    def alive(self) -> List[str]:
+        with self._lock:
+            now = time.time()
+            self._db.execute("DELETE FROM leases WHERE expires < ?", (now,))
+            return [member for member, in self._db.execute("SELECT member FROM leases WHERE expires >= ?", (now,))]
+
+    def release(self, member: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM leases WHERE member = ?", (member,))
+
+
+class FileLeaseBackend(LeaseBackend):
+
+    def __init__(self, directory: str):
+        self.directory: str = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, member: str) -> str:
+        return os.path.join(self.directory, member.replace(os.sep, "_") + ".lease")
+
+    def renew(self, member: str, ttl: float) -> None:
+        path = self._path(member)
+        # write-then-rename, so readers never see a half-written expiry
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(f"{member}\n{time.time() + ttl}\n")
+        os.replace(temporary, path)
+
+    def alive(self) -> List[str]:
+        now = time.time()
+        members = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".lease"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    member, expires = f.read().split()
+            except (OSError, ValueError):
+                continue
+            if float(expires) >= now:
+                members.append(member)
+        return members
+
+    def release(self, member: str) -> None:
+        try:
+            os.remove(self._path(member))
+        except FileNotFoundError:
+            pass
+
+
+LEASE_BACKENDS: Dict[str, Type[LeaseBackend]] = {
+    "sqlite": SQLiteLeaseBackend,
+    "file": FileLeaseBackend,
+}
+
+
+class ShardCoordinator:
+
+    def __init__(self,
+                 instance_id: str,
+                 backend: LeaseBackend,
+                 members: Optional[List[str]] = None,
+                 lease_ttl: float = 15.0,
+                 heartbeat: float = 5.0,
+                 vnodes: int = 64,
+                 on_rebalance: Optional[Callable[["ShardCoordinator"], None]] = None):
+        self.instance_id: str = instance_id
+        self.backend: LeaseBackend = backend
+        # with a fixed member list only those ids take part; otherwise anyone holding a lease does
+        self.configured: Optional[Tuple[str, ...]] = tuple(members) if members else None
+        self.lease_ttl: float = lease_ttl
+        self.heartbeat: float = heartbeat
+        self.vnodes: int = vnodes
+        self.on_rebalance: Optional[Callable[["ShardCoordinator"], None]] = on_rebalance
+        self.ring: HashRing = HashRing([instance_id], vnodes)
+        self.previous: HashRing = self.ring
+        self.changed_at: float = 0.0
+        self.rebalances: int = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def owns(self, conversation_id: Hashable) -> bool:
+        if self.ring.owner(conversation_id) != self.instance_id:
+            return False
+        # a conversation that just moved here may still be in flight on its previous owner;
+        # wait one lease period before taking it over
+        if time.monotonic() - self.changed_at < self.lease_ttl:
+            return self.previous.owner(conversation_id) in (self.instance_id, None)
+        return True
+
+    def held_back(self, conversation_id: Hashable) -> bool:
+        # ours on the current ring, only waiting out the grace period; nobody else will answer it
+        return self.ring.owner(conversation_id) == self.instance_id and not self.owns(conversation_id)
+
+    async def refresh(self) -> None:
+        await asyncio.to_thread(self.backend.renew, self.instance_id, self.lease_ttl)
+        alive = set(await asyncio.to_thread(self.backend.alive))
+        alive.add(self.instance_id)
+        if self.configured is not None:
+            alive &= set(self.configured) | {self.instance_id}
+        if tuple(sorted(alive)) != self.ring.members:
+            self.previous, self.ring = self.ring, HashRing(list(alive), self.vnodes)
+            self.changed_at = time.monotonic()
+            self.rebalances += 1
+            log.info(f"[Shards] Membership changed to {', '.join(self.ring.members)}; rebalancing.")
+            if self.on_rebalance is not None:
+                self.on_rebalance(self)
+
+    async def start(self) -> None:
+        await self.refresh()
+        others = [member for member in self.ring.members if member != self.instance_id]
+        if others:
+            # joining a running group: what we take over may still be in flight on the others
+            self.previous = HashRing(others, self.vnodes)
+            self.changed_at = time.monotonic()
+        else:
+            self.previous = self.ring
+            self.changed_at = 0.0
+        self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self.refresh()
+            except Exception as e:
+                log.warning(f"[Shards] Could not renew lease for {self.instance_id}: {e}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # leaving explicitly lets the others take over without waiting for the lease to expire
+        await asyncio.to_thread(self.backend.release, self.instance_id)
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ollama import Message
+from nc_py_api.talk import Conversation
+from lib.log_sink import get_logger
+from typing import Dict, Hashable, List, Optional, Tuple
+
+log = get_logger()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    conversation_id INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reactions (
+    conversation_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    emoji TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, message_id)
+);
+CREATE TABLE IF NOT EXISTS fragments (
+    message_id INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (message_id, digest)
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cursors (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class StateStore:
+
+    def __init__(self, path: str, fragment_limit: int = 5000) -> None:
+        self.path: str = path
+        self.fragment_limit: int = fragment_limit
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # writes happen on a worker thread during flush, reads only at startup
+        self._db: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(fragments)")]
+        if "length" in columns:
+            # fragments used to be keyed on the text length, which misses same-length edits; they are only a cache
+            self._db.execute("DROP TABLE fragments")
+        self._db.executescript(_SCHEMA)
+        self._lock: threading.Lock = threading.Lock()
+        # changes are buffered and written in one transaction per flush
+        self._processed: Dict[int, int] = {}
+        self._reactions: Dict[Tuple[int, int], Optional[str]] = {}
+        self._fragments: Dict[Tuple[int, str], Tuple[str, str, int]] = {}
+        self._conversations: Dict[int, Optional[dict]] = {}
+        self._cursors: Dict[str, int] = {}
+        log.info(f"[State] Opened state store at {path}.")
+
+    def load_processed(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._db.execute("SELECT conversation_id, message_id FROM processed"))
+
+    def load_reactions(self) -> Dict[Tuple[int, int], str]:
+        with self._lock:
+            rows = self._db.execute("SELECT conversation_id, message_id, emoji FROM reactions")
+            return {(conversation_id, message_id): emoji for conversation_id, message_id, emoji in rows}
+
+    def load_fragments(self) -> List[Tuple[Hashable, Message, int]]:
+        # oldest first, so inserting them in order leaves the most recently used at the LRU tail
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT message_id, digest, role, content, tokens FROM fragments ORDER BY used DESC LIMIT ?",
+                (self.fragment_limit,)).fetchall()
+        return [((message_id, digest), Message(role=role, content=content), tokens)
+                for message_id, digest, role, content, tokens in reversed(rows)]
+
+    def load_conversations(self) -> Tuple[List[Conversation], int]:
+        with self._lock:
+            rows = self._db.execute("SELECT data FROM conversations").fetchall()
+            cursor = self._db.execute("SELECT value FROM cursors WHERE name = 'conversations'").fetchone()
+        return [Conversation(json.loads(data)) for data, in rows], cursor[0] if cursor else 0
+
+    def record_processed(self, conversation_id: int, message_id: int) -> None:
+        self._processed[conversation_id] = message_id
+
+    def record_reaction(self, conversation_id: int, message_id: int, emoji: Optional[str]) -> None:
+        self._reactions[(conversation_id, message_id)] = emoji or None
+
+    def record_fragment(self, key: Tuple[int, str], message: Message, tokens: int) -> None:
+        self._fragments[key] = (message.role, message.content or "", tokens)
+
+    def record_conversation(self, conversation_id: int, data: Optional[dict]) -> None:
+        self._conversations[conversation_id] = data
+
+    def record_cursor(self, name: str, value: int) -> None:
+        self._cursors[name] = value
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._processed or self._reactions or self._fragments or self._conversations or self._cursors)
+
+    async def flush(self) -> None:
+        if not self.dirty:
+            return
+        processed, self._processed = self._processed, {}
+        reactions, self._reactions = self._reactions, {}
+        fragments, self._fragments = self._fragments, {}
+        conversations, self._conversations = self._conversations, {}
+        cursors, self._cursors = self._cursors, {}
+        try:
+            await asyncio.to_thread(self._write, processed, reactions, fragments, conversations, cursors)
+        except Exception as e:
+            log.error(f"[State] Could not persist state: {e}")
+            # a later cursor must not be written without the rooms this one covered
+            self._conversations = {**conversations, **self._conversations}
+            self._cursors = {**cursors, **self._cursors}
+
+    def _write(self,
+               processed: Dict[int, int],
+               reactions: Dict[Tuple[int, int], Optional[str]],
+               fragments: Dict[Tuple[int, str], Tuple[str, str, int]],
+               conversations: Dict[int, Optional[dict]],
+               cursors: Dict[str, int]) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO processed VALUES (?, ?, ?)",
+                    [(conversation_id, message_id, now) for conversation_id, message_id in processed.items()])
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO reactions VALUES (?, ?, ?)",
+                    [(*key, emoji) for key, emoji in reactions.items() if emoji])
+                self._db.executemany(
+                    "DELETE FROM reactions WHERE conversation_id = ? AND message_id = ?",
+                    [key for key, emoji in reactions.items() if not emoji])
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?, ?, ?)",
+                    [(*key, role, content, tokens, now) for key, (role, content, tokens) in fragments.items()])
+                if fragments:
+                    self._db.execute(
+                        "DELETE FROM fragments WHERE rowid NOT IN "
+                        "(SELECT rowid FROM fragments ORDER BY used DESC LIMIT ?)", (self.fragment_limit,))
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO conversations VALUES (?, ?)",
+                    [(conversation_id, json.dumps(data)) for conversation_id, data in conversations.items() if data])
+                self._db.executemany(
+                    "DELETE FROM conversations WHERE conversation_id = ?",
+                    [(conversation_id,) for conversation_id, data in conversations.items() if not data])
+                # the cursor is written with the rooms it covers, so a restart never skips a delta
+                self._db.executemany("INSERT OR REPLACE INTO cursors VALUES (?, ?)", list(cursors.items()))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    async def run_flusher(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def close(self) -> None:
+        await self.flush()
+        with self._lock:
+            self._db.close()
+        log.info("[State] State store closed.")
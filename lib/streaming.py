@@ -0,0 +1,114 @@
+import time
+
+from nc_py_api.talk import Conversation, TalkMessage
+from lib.log_sink import get_logger
+from typing import AsyncIterator, Optional
+
+log = get_logger()
+
+
+class ThinkStripper:
+    OPEN_TAG: str = "<think>"
+    CLOSE_TAG: str = "</think>"
+
+    def __init__(self) -> None:
+        self._buffer: str = ""
+        self._thinking: bool = False
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+        visible = []
+        while self._buffer:
+            tag = self.CLOSE_TAG if self._thinking else self.OPEN_TAG
+            index = self._buffer.find(tag)
+            if index != -1:
+                if not self._thinking:
+                    visible.append(self._buffer[:index])
+                self._buffer = self._buffer[index + len(tag):]
+                self._thinking = not self._thinking
+                continue
+            # hold back what could be the beginning of a tag split across chunks
+            keep = self._partial_tag_length(tag)
+            if not self._thinking:
+                visible.append(self._buffer[:len(self._buffer) - keep])
+            self._buffer = self._buffer[len(self._buffer) - keep:]
+            break
+        return "".join(visible)
+
+    def flush(self) -> str:
+        remaining = "" if self._thinking else self._buffer
+        self._buffer = ""
+        self._thinking = False
+        return remaining
+
+    def _partial_tag_length(self, tag: str) -> int:
+        for length in range(min(len(tag) - 1, len(self._buffer)), 0, -1):
+            if self._buffer.endswith(tag[:length]):
+                return length
+        return 0
+
+
+class StreamingReply:
+
+    def __init__(self,
+                 nc_bot,
+                 conversation: Conversation,
+                 first_chars: int = 40,
+                 first_delay: float = 1.0,
+                 edit_interval: float = 2.0):
+        self.nc_bot = nc_bot
+        self.conversation: Conversation = conversation
+        self.first_chars: int = first_chars
+        self.first_delay: float = first_delay
+        self.edit_interval: float = edit_interval
+        self.posted: Optional[TalkMessage] = None
+        self._sent: str = ""
+        self._last_edit: float = 0.0
+
+    async def run(self, chunks: AsyncIterator[str]) -> str:
+        stripper = ThinkStripper()
+        text = ""
+        started = time.monotonic()
+        async for chunk in chunks:
+            text += stripper.feed(chunk)
+            visible = text.strip()
+            if not visible:
+                continue
+            now = time.monotonic()
+            if self.posted is None:
+                if len(visible) >= self.first_chars or now - started >= self.first_delay:
+                    await self._post(visible)
+                    log.info(f"[Stream] First text visible in {self.conversation.display_name} after {now - started:.2f}s.")
+            elif now - self._last_edit >= self.edit_interval and visible != self._sent:
+                try:
+                    await self._edit(visible)
+                except Exception as e:
+                    log.warning(f"[Stream] Intermediate edit failed for {self.conversation.display_name}: {e}")
+
+        visible = (text + stripper.flush()).strip()
+        if not visible:
+            raise RuntimeError("Ollama returned an invalid response")
+        if self.posted is None:
+            await self._post(visible)
+        elif visible != self._sent:
+            await self._edit(visible)
+        return visible
+
+    async def abandon(self, marker: str) -> None:
+        # the partial text stays in the chat, so it must not read like a finished answer
+        if self.posted is None:
+            return
+        try:
+            await self._edit(f"{self._sent} … {marker}")
+        except Exception as e:
+            log.warning(f"[Stream] Could not mark the partial reply in {self.conversation.display_name}: {e}")
+
+    async def _post(self, text: str) -> None:
+        self.posted = await self.nc_bot.send_message(self.conversation, text)
+        self._sent = text
+        self._last_edit = time.monotonic()
+
+    async def _edit(self, text: str) -> None:
+        await self.nc_bot.edit_message(self.conversation, self.posted, text)
+        self._sent = text
+        self._last_edit = time.monotonic()
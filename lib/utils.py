@@ -1,11 +1,11 @@
 from lib.constants import USELESS_MESSAGES
-from nc_py_api.talk import TalkMessage, MessageReactions
-from ollama import AsyncClient, Message, GenerateResponse, ChatResponse
-from simple_logger import Logger
+from nc_py_api.talk import TalkMessage
+from ollama import Message
+from lib.log_sink import get_logger
 from datetime import datetime
 from typing import List
 
-log = Logger()
+log = get_logger()
 
 
 class Filters():
@@ -28,7 +28,7 @@ class Filters():
         filtered: List[TalkMessage] = []
         for m in messages:
             if self.is_structurally_useless(m):
-                log.debug(f"[Filters] discarded message: {m.message}")
+                log.debug("[Filters] discarded message: %s", m.message)
             else:
                 filtered.append(m)
         return filtered
@@ -41,17 +41,29 @@ class Filters():
 class Mappers():
 
     def talk_message_to_ollama_message(self, talk_message: TalkMessage,
-                                       assistant_id: str) -> Message:
+                                       assistant_id: str,
+                                       metadata: str = "full",
+                                       speaker: bool = False) -> Message:
         human_timestamp = datetime.fromtimestamp(talk_message.timestamp)
+        # in group rooms the model has to know who said what
+        text = f"{talk_message.actor_display_name}: {talk_message.message}" if speaker else talk_message.message
 
-        context = f"""
+        if talk_message.actor_id == assistant_id:
+            content = talk_message.message
+        elif metadata == "none":
+            content = text
+        elif metadata == "compact":
+            parent = talk_message.parent
+            reply = f" (reply to #{parent.get('id')})" if isinstance(parent, dict) and parent.get("id") else ""
+            content = f"[{human_timestamp:%Y-%m-%d %H:%M} #{talk_message.message_id}{reply}] {text}"
+        else:
+            context = f"""
         Timestamp: {human_timestamp}
         Id:{talk_message.message_id}
         Replies to:{talk_message.parent}
         Reactions: {talk_message.reactions}      
         """
-
-        content = talk_message.message if talk_message.actor_id == assistant_id else f"Context (ignore for generation): {context} \n Message: {talk_message.message}"
+            content = f"Context (ignore for generation): {context} \n Message: {text}"
 
         return Message(role="assistant"
                        if talk_message.actor_id == assistant_id else "user",
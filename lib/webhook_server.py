@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import json
+import secrets
+
+from aiohttp import web
+from lib.log_sink import get_logger
+from typing import Awaitable, Callable, Dict, Optional
+
+log = get_logger()
+
+RANDOM_HEADER: str = "X-Nextcloud-Talk-Random"
+SIGNATURE_HEADER: str = "X-Nextcloud-Talk-Signature"
+
+
+def sign(secret: str, random: str, body: bytes) -> str:
+    return hmac.new(secret.encode(), random.encode() + body, hashlib.sha256).hexdigest()
+
+
+def sign_request(secret: str, body: bytes) -> Dict[str, str]:
+    random = secrets.token_hex(32)
+    return {RANDOM_HEADER: random, SIGNATURE_HEADER: sign(secret, random, body)}
+
+
+def verify(secret: str, random: str, signature: str, body: bytes) -> bool:
+    if not random or not signature:
+        return False
+    return hmac.compare_digest(sign(secret, random, body), signature.lower())
+
+
+class WebhookServer:
+
+    def __init__(self,
+                 secret: str,
+                 on_message: Callable[[str, dict], Awaitable[None]],
+                 host: str = "0.0.0.0",
+                 port: int = 8080,
+                 path: str = "/webhook",
+                 ignored_actors: tuple = ()):
+        self.secret: str = secret
+        self.on_message: Callable[[str, dict], Awaitable[None]] = on_message
+        self.host: str = host
+        self.port: int = port
+        self.path: str = path
+        self.ignored_actors: tuple = ignored_actors
+        self.app: web.Application = web.Application()
+        self.app.router.add_post(self.path, self.handle)
+        self.runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> int:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        # report the real port when an ephemeral one (0) was requested
+        self.port = self.runner.addresses[0][1]
+        log.info("[Webhook] Listening on %s:%s%s", self.host, self.port, self.path)
+        return self.port
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not verify(self.secret,
+                      request.headers.get(RANDOM_HEADER, ""),
+                      request.headers.get(SIGNATURE_HEADER, ""),
+                      body):
+            log.warning("[Webhook] Rejected event with an invalid signature.")
+            return web.Response(status=401)
+
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+
+        if event.get("type") != "Create" or event.get("object", {}).get("name") != "message":
+            return web.Response(status=200)
+        if event.get("actor", {}).get("id") in self.ignored_actors:
+            return web.Response(status=200)
+
+        token = event.get("target", {}).get("id")
+        if not token:
+            return web.Response(status=400)
+
+        log.debug("[Webhook] New message event for conversation %s", token)
+        try:
+            await self.on_message(token, event)
+        except Exception as e:
+            log.error("[Webhook] Failed to handle event for conversation %s: %s", token, e)
+            return web.Response(status=500)
+        return web.Response(status=200)
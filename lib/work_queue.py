@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class KeyedWorkQueue:
+
+    def __init__(self,
+                 key: Callable[[Any], Hashable] = lambda item: item.conversation_id,
+                 version: Optional[Callable[[Any], Hashable]] = None,
+                 on_wait: Optional[Callable[[float], None]] = None,
+                 on_coalesce: Optional[Callable[[str], None]] = None):
+        self.key: Callable[[Any], Hashable] = key
+        # items with the same key and version describe the same work and are dropped
+        self.version: Optional[Callable[[Any], Hashable]] = version
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._pending: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._in_flight: Dict[Hashable, Any] = {}
+        # newest item seen for a key while its job was running; re-queued once the job finishes
+        self._dirty: Dict[Hashable, Any] = {}
+        self._completed: Dict[Hashable, Hashable] = {}
+        self._queued_at: Dict[Hashable, float] = {}
+        self.on_wait: Optional[Callable[[float], None]] = on_wait
+        # told where an item was folded into existing work: "completed", "running" or "pending"
+        self.on_coalesce: Optional[Callable[[str], None]] = on_coalesce
+
+    def qsize(self) -> int:
+        return len(self._pending)
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def is_in_flight(self, item: Any) -> bool:
+        return self.key(item) in self._in_flight
+
+    def is_dirty(self, item: Any) -> bool:
+        return self.key(item) in self._dirty
+
+    def is_known(self, item: Any) -> bool:
+        key = self.key(item)
+        return key in self._pending or key in self._in_flight
+
+    def _coalesced(self, state: str) -> None:
+        if self.on_coalesce is not None:
+            self.on_coalesce(state)
+
+    async def put(self, item: Optional[Any]) -> bool:
+        if item is None:
+            await self._ready.put(None)
+            return True
+
+        key = self.key(item)
+        if self.version is not None and self._completed.get(key) == self.version(item):
+            self._coalesced("completed")
+            return False
+        if key in self._in_flight:
+            self._coalesced("running")
+            if self._same_version(self._dirty.get(key, self._in_flight[key]), item):
+                return False
+            self._dirty[key] = item
+            return True
+        if key in self._pending:
+            self._coalesced("pending")
+            previous = self._pending[key]
+            self._pending[key] = item
+            return not self._same_version(previous, item)
+
+        self._pending[key] = item
+        self._queued_at[key] = time.monotonic()
+        await self._ready.put(key)
+        return True
+
+    def restore_completed(self, completed: Dict[Hashable, Hashable]) -> None:
+        for key, version in completed.items():
+            self._completed.setdefault(key, version)
+
+    def _same_version(self, a: Any, b: Any) -> bool:
+        return self.version is not None and self.version(a) == self.version(b)
+
+    async def get(self) -> Optional[Any]:
+        key = await self._ready.get()
+        if key is None:
+            return None
+        item = self._pending.pop(key)
+        self._in_flight[key] = item
+        queued_at = self._queued_at.pop(key, None)
+        if self.on_wait is not None and queued_at is not None:
+            self.on_wait(time.monotonic() - queued_at)
+        return item
+
+    def task_done(self, item: Any, completed: bool = True) -> None:
+        key = self.key(item)
+        self._in_flight.pop(key, None)
+        if completed and self.version is not None:
+            self._completed[key] = self.version(item)
+        dirty = self._dirty.pop(key, None)
+        if dirty is not None:
+            self._pending[key] = dirty
+            self._queued_at[key] = time.monotonic()
+            self._ready.put_nowait(key)
+
+
+class AgingPriorityQueue:
+
+    def __init__(self,
+                 cost: Callable[[Any], float] = lambda item: 0.0,
+                 aging: float = 1.0,
+                 on_wait: Optional[Callable[[float], None]] = None):
+        # lowest cost goes first; every second spent waiting lowers an item's cost by `aging`
+        self.cost: Callable[[Any], float] = cost
+        self.aging: float = aging
+        self.on_wait: Optional[Callable[[float], None]] = on_wait
+        self._items: List[Tuple[float, Any]] = []
+        self._not_empty: asyncio.Event = asyncio.Event()
+        self._closed: bool = False
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def put_nowait(self, item: Any) -> None:
+        self._items.append((time.monotonic(), item))
+        self._not_empty.set()
+
+    def close(self) -> None:
+        self._closed = True
+        self._not_empty.set()
+
+    def oldest_wait(self) -> float:
+        return time.monotonic() - min(enqueued_at for enqueued_at, _ in self._items) if self._items else 0.0
+
+    async def get(self) -> Optional[Any]:
+        while not self._items:
+            if self._closed:
+                return None
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+        now = time.monotonic()
+        best = min(range(len(self._items)),
+                   key=lambda index: self.cost(self._items[index][1]) - self.aging * (now - self._items[index][0]))
+        enqueued_at, item = self._items.pop(best)
+        if self.on_wait is not None:
+            self.on_wait(now - enqueued_at)
+        return item
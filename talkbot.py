@@ -1,60 +1,282 @@
 import asyncio
+import signal
+import time
 
-from nc_py_api.talk import Conversation, TalkMessage,ConversationType
+STARTED = time.monotonic()
+
+from nc_py_api.talk import Conversation, TalkMessage
 from lib.ollama_client import OllamaChat as OllamaAI
 from lib.message_processor import MessageProcessor
 from lib.nextcloud_client import NextcloudClient
-from simple_logger import Logger
+from lib.log_sink import get_logger
 from lib.config import Config
-from typing import List
+from typing import Dict, List, Optional
 from lib.constants import REACTIONS
+from lib.scheduler import PollScheduler
+from lib.http_pool import HttpClients
+from lib.state_store import StateStore
+from lib.response_cache import ResponseCache
+from lib.resilience import get_resilience
+from lib.sharding import LEASE_BACKENDS, ShardCoordinator, default_instance_id
+from lib.metrics import REGISTRY, MetricsServer, POLL_DURATION, POLL_CONVERSATIONS, QUEUE_DEPTH, QUEUE_OLDEST_WAIT, HTTP_POOL, SCHEDULER, BREAKER_OPEN, RATE_LIMIT_WAIT, RESPONSE_CACHE_SIZE, DEFERRED
+
+log=get_logger()
 
-log=Logger()
+IMPORTED = time.monotonic()
 
 
 class TalkBot:
 
-    def __init__(self):
+    def __init__(self, conf: Optional[Config] = None):
         log.info("[TalkBot] Initializing NextcloudBot and OllamaAI...")
-        self.conf = Config()
-        self.nc_bot = NextcloudClient()
-        self.ollama = OllamaAI()
-        self.processor=MessageProcessor(self.nc_bot,self.ollama)
+        # seconds per startup phase, reported once the first poll is done
+        self.startup: Dict[str, float] = {"imports": IMPORTED - STARTED}
+        phase = time.monotonic()
+        # resolved once here and handed down, instead of every component reading it on its own
+        self.conf = conf or Config()
+        self.startup["config"] = time.monotonic() - phase
+        phase = time.monotonic()
+        self.http = HttpClients(self.conf)
+        self.state = StateStore(self.conf.STATE_PATH, fragment_limit=int(self.conf.STATE_FRAGMENT_LIMIT)) if self.conf.STATE_PATH else None
+        self.startup["state"] = time.monotonic() - phase
+        phase = time.monotonic()
+        self.nc_bot = NextcloudClient(self.http, state=self.state, conf=self.conf)
+        self.ollama = OllamaAI(self.http, conf=self.conf)
+        self.response_cache = ResponseCache(
+            max_entries=int(self.conf.RESPONSE_CACHE_SIZE),
+            ttl=float(self.conf.RESPONSE_CACHE_TTL),
+            messages=int(self.conf.RESPONSE_CACHE_MESSAGES),
+            path=self.conf.RESPONSE_CACHE_PATH,
+            excluded=self.conf.RESPONSE_CACHE_EXCLUDE.split(",")) if self.conf.RESPONSE_CACHE_ENABLED else None
+        self.processor=MessageProcessor(self.nc_bot,self.ollama,state=self.state,response_cache=self.response_cache,conf=self.conf)
+        self.startup["clients"] = time.monotonic() - phase
         self.check_interval = int(self.conf.NEXTCLOUD_CHECK_INTERVAL)
+        self.conversation_types = ("ONE_TO_ONE", "GROUP", "PUBLIC") if self.conf.GROUP_ENABLED else ("ONE_TO_ONE",)
+        self.webhook = None
+        self.state_flusher = None
+        self.cache_flusher = None
+        self.metrics = None
+        self.shards = None
+        self.scheduler = None
+        self.preload: Optional[asyncio.Task] = None
+        self.workers: Optional[asyncio.Task] = None
+        self.stopping: asyncio.Event = asyncio.Event()
+        self.stopped: bool = False
 
     async def monitor_and_reply(self, check_interval: int = 2) -> None:
         log.info("[Monitor] Starting conversation monitor...")
-        asyncio.create_task(self.processor.start_workers())
-        
-        while True:
+        phase = time.monotonic()
+        await self.nc_bot.connect()
+        if int(self.conf.OLLAMA_PRELOAD):
+            # loading the model takes seconds; do it while the first poll is still talking to Nextcloud
+            self.preload = asyncio.create_task(self.ollama.warm_up())
+        self.workers = asyncio.create_task(self.processor.start_workers())
+        self.ollama.pool.start_health_checks()
+        services = []
+        if self.conf.SHARD_ENABLED:
+            services.append(self.start_sharding())
+        if self.state:
+            self.state_flusher = asyncio.create_task(self.state.run_flusher(float(self.conf.STATE_FLUSH_INTERVAL)))
+        if self.response_cache is not None and self.response_cache.path:
+            self.cache_flusher = asyncio.create_task(self.response_cache.run_flusher(float(self.conf.STATE_FLUSH_INTERVAL)))
+
+        min_interval = float(self.conf.NEXTCLOUD_MIN_CHECK_INTERVAL)
+        max_interval = float(self.conf.NEXTCLOUD_MAX_CHECK_INTERVAL)
+        if self.conf.WEBHOOK_ENABLED:
+            services.append(self.start_webhook_server())
+            # webhook events drive replies, polling only reconciles missed events
+            check_interval = min_interval = max_interval = int(self.conf.WEBHOOK_FALLBACK_INTERVAL)
+        self.scheduler = PollScheduler(
+            min_interval=min_interval,
+            max_interval=max_interval,
+            initial_interval=check_interval,
+            backoff=float(self.conf.NEXTCLOUD_IDLE_BACKOFF),
+            jitter=float(self.conf.NEXTCLOUD_CHECK_JITTER))
+        if self.conf.METRICS_ENABLED:
+            services.append(self.start_metrics_server())
+        await asyncio.gather(*services)
+        self.startup["services"] = time.monotonic() - phase
+
+        while not self.stopping.is_set():
+            conversations: List[Conversation] = []
+            started = time.monotonic()
+            with log.span("poll") as span:
+                try:
+                    conversations = await self.get_unread_conversations()
+                    for index, conversation in enumerate(conversations):
+                        if not self.processor.accepts(conversation):
+                            # backpressure: the rest stays unread in Nextcloud and in the index until there is room
+                            deferred = conversations[index:]
+                            self.nc_bot.conversations.defer(deferred)
+                            DEFERRED.inc(len(deferred))
+                            log.sampled("monitor.backpressure", float(self.conf.LOG_SAMPLE_INTERVAL), "warning",
+                                        "[Monitor] Processing queue is full (%d); deferring %d conversations.",
+                                        self.processor.pending(), len(deferred))
+                            break
+                        await self.enqueue_conversation(conversation)
+                except Exception as e:
+                    log.error(f"[Monitor] Failed to monitor and reply: {e}")
+                POLL_DURATION.observe(time.monotonic() - started)
+                POLL_CONVERSATIONS.inc(len(conversations))
+
+                self.scheduler.record(unread=len(conversations),
+                                      in_flight=self.processor.in_flight + self.processor.queue.qsize())
+                sleep = self.scheduler.next_sleep()
+                span.set(unread=len(conversations), sleep=round(sleep, 1))
+            if "first_poll" not in self.startup:
+                self.startup["first_poll"] = time.monotonic() - started
+                self.report_startup()
+            try:
+                await asyncio.wait_for(self.stopping.wait(), sleep)
+            except asyncio.TimeoutError:
+                pass
+        log.info("[Monitor] Stopped polling.")
+
+    def report_startup(self) -> None:
+        phases = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.startup.items())
+        preload = "running" if self.preload is not None and not self.preload.done() else "done"
+        log.info("[Startup] Ready %.0fms after launch (%s; model preload %s).",
+                 (time.monotonic() - STARTED) * 1000, phases, preload)
+
+    async def enqueue_conversation(self, conversation: Conversation) -> None:
+        if self.shards is not None and not self.shards.owns(conversation.conversation_id):
+            if self.shards.held_back(conversation.conversation_id):
+                # drained already: handing it back keeps its unread messages until the grace period is over
+                log.debug("[Monitor] %s moved here and is still held back; deferring.", conversation.display_name)
+                self.nc_bot.conversations.defer([conversation])
+                DEFERRED.inc()
+                return
+            log.debug("[Monitor] %s belongs to another shard; skipping.", conversation.display_name)
+            return
+        log.debug("[Monitor] Unread messages found in %s.", conversation.display_name)
+        if not await self.processor.add_to_queue(conversation):
+            return
+        if self.processor.is_group(conversation):
+            # most group chatter is not for the bot; the worker marks a message once the trigger matches it
+            return
+        await self.nc_bot.clear_reactions(conversation=conversation)
+        if conversation.last_message is not None:
+            try:
+                await self.nc_bot.set_reaction(conversation=conversation,message=conversation.last_message,reaction=REACTIONS.get("SEEN"))
+            except Exception as e:
+                log.warning("[Monitor] could not set reaction")
+        else:
+            log.warning(f"[Monitor] Conversation {conversation.conversation_id} has no last_message; skipping reaction.")
+
+    async def start_webhook_server(self) -> None:
+        from lib.webhook_server import WebhookServer
+
+        self.webhook = WebhookServer(
+            secret=self.conf.WEBHOOK_SECRET,
+            on_message=self.on_webhook_message,
+            host=self.conf.WEBHOOK_HOST,
+            port=int(self.conf.WEBHOOK_PORT),
+            path=self.conf.WEBHOOK_PATH,
+            ignored_actors=(f"users/{self.conf.OLLAMA_ACTOR_ID}", f"users/{self.conf.NEXTCLOUD_USERNAME}"))
+        await self.webhook.start()
+
+    async def start_sharding(self) -> None:
+        backend = LEASE_BACKENDS[self.conf.SHARD_BACKEND](self.conf.SHARD_LEASE_PATH)
+        self.shards = ShardCoordinator(
+            instance_id=self.conf.SHARD_ID or default_instance_id(),
+            backend=backend,
+            members=[member.strip() for member in self.conf.SHARD_MEMBERS.split(",") if member.strip()],
+            lease_ttl=float(self.conf.SHARD_LEASE_TTL),
+            heartbeat=float(self.conf.SHARD_HEARTBEAT),
+            on_rebalance=self.on_rebalance)
+        await self.shards.start()
+        log.info(f"[Shards] Running as {self.shards.instance_id} among {', '.join(self.shards.ring.members)}.")
+
+    def on_rebalance(self, shards: ShardCoordinator) -> None:
+        # rooms of a departed peer were drained and skipped here while it owned them, and stay unchanged until
+        # their next message; offer the unread ones that moved to this instance again
+        moved = [conversation for conversation in self.nc_bot.conversations.unread(self.conversation_types)
+                 if shards.ring.owner(conversation.conversation_id) == shards.instance_id
+                 and shards.previous.owner(conversation.conversation_id) != shards.instance_id]
+        if moved:
+            log.info(f"[Shards] Taking over {len(moved)} unread conversations after rebalancing.")
+            self.nc_bot.conversations.defer(moved)
+
+    async def start_metrics_server(self) -> None:
+        REGISTRY.enabled = True
+        REGISTRY.add_collector(self.collect_metrics)
+        self.metrics = MetricsServer(REGISTRY, host=self.conf.METRICS_HOST,
+                                     port=int(self.conf.METRICS_PORT), path=self.conf.METRICS_PATH)
+        await self.metrics.start()
+
+    def collect_metrics(self) -> None:
+        QUEUE_DEPTH.set(self.processor.queue.qsize(), stage="prepare", state="waiting")
+        QUEUE_DEPTH.set(self.processor.queue.in_flight(), stage="prepare", state="running")
+        QUEUE_DEPTH.set(self.processor.generation_queue.qsize(), stage="generation", state="waiting")
+        QUEUE_DEPTH.set(len(self.processor.generations), stage="generation", state="running")
+        QUEUE_OLDEST_WAIT.set(self.processor.generation_queue.oldest_wait())
+        for upstream, stats in self.http.stats().items():
+            for stat, value in stats.items():
+                HTTP_POOL.set(value, upstream=upstream, stat=stat)
+        if self.scheduler is not None:
+            for stat, value in self.scheduler.stats().items():
+                SCHEDULER.set(value, stat=stat)
+        if self.response_cache is not None:
+            RESPONSE_CACHE_SIZE.set(len(self.response_cache))
+        for endpoint, limiter in get_resilience().limiters.items():
+            RATE_LIMIT_WAIT.set(limiter.waited, endpoint=endpoint)
+        for service, breaker in get_resilience().breakers.items():
+            BREAKER_OPEN.set(1 if breaker.state != breaker.CLOSED else 0, service=service)
+
+    def request_shutdown(self) -> None:
+        if not self.stopping.is_set():
+            log.info("[TalkBot] Shutdown requested; finishing replies in progress.")
+            self.stopping.set()
+
+    async def shutdown(self) -> None:
+        if self.stopped:
+            return
+        self.stopped = True
+        self.stopping.set()
+        # no new events while draining; polling has already stopped
+        if self.webhook is not None:
+            await self.webhook.stop()
+            self.webhook = None
+        timeout = float(self.conf.NEXTCLOUD_SHUTDOWN_TIMEOUT)
+        if await self.processor.drain(timeout):
+            log.info("[TalkBot] All replies in progress finished.")
+        else:
+            # unfinished conversations are not recorded as answered and stay unread, so the next start picks them up
+            log.warning(f"[TalkBot] {self.processor.pending()} conversations still in progress after {timeout:.0f}s; leaving them for the next start.")
+        await self.processor.stop_workers()
+        if self.workers is not None:
             try:
-                log.info("[Monitor] Checking for unread messages...")
-                conversations = await self.get_unread_conversations()
-                for conversation in conversations:
-                    await self.nc_bot.clear_reactions(conversation=conversation)
-                    log.info(f"[Monitor] Unread messages found in {conversation.display_name}. Adding conversation to queue...")
-                    await self.processor.add_to_queue(conversation)
-                    if conversation.last_message is not None:
-                        try:
-                            await self.nc_bot.set_reaction(conversation=conversation,message=conversation.last_message,reaction=REACTIONS.get("SEEN"))
-                        except Exception as e:
-                            log.warning("[Monitor] could not set reaction")
-                    else:
-                        log.warning(f"[Monitor] Conversation {conversation.conversation_id} has no last_message; skipping reaction.")
+                await asyncio.wait_for(self.workers, 5.0)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
             except Exception as e:
-                log.error(f"[Monitor] Failed to monitor and reply: {e}")
-            
-            log.info(f"[Monitor] Sleeping for {check_interval} seconds...")
-            await asyncio.sleep(check_interval)
+                log.warning(f"[TalkBot] Workers stopped with an error: {e}")
+        await self.close()
+
+    async def on_webhook_message(self, token: str, event: dict) -> None:
+        if self.stopping.is_set():
+            return
+        conversation = await self.nc_bot.retrieve_conversation_by_token(token, fresh=True)
+        if conversation is None:
+            log.warning(f"[Webhook] Conversation {token} is not known to the bot; ignoring event.")
+            return
+        if conversation.conversation_type.name not in self.conversation_types:
+            return
+        if not self.processor.accepts(conversation):
+            # left for the poll that follows once there is room again
+            self.nc_bot.conversations.defer([conversation])
+            DEFERRED.inc()
+            return
+        await self.enqueue_conversation(conversation)
     
     async def get_unread_conversations(self) -> List[Conversation]:
         try:
-            conversations : List[Conversation] = await self.nc_bot.get_user_conversations(modified_since=True)
-            unanswered_conversations= [conv for conv in conversations if conv.conversation_type.name == "ONE_TO_ONE" and conv.unread_messages_count > 0]
+            unanswered_conversations: List[Conversation] = await self.nc_bot.get_unread_conversations(self.conversation_types)
             if unanswered_conversations:
-                log.info(f"[Monitor] Found {len(unanswered_conversations)} conversations with unread messages.")
+                log.info("[Monitor] Found %d conversations with unread messages.", len(unanswered_conversations))
             else:
-                log.info("[Monitor] No conversations with unread messages found.")
+                log.sampled("monitor.idle", float(self.conf.LOG_SAMPLE_INTERVAL), "info",
+                            "[Monitor] No conversations with unread messages found.")
             return unanswered_conversations
         except Exception as e:
             log.error(f"[Monitor] Failed to retrieve unread conversations: {e}")
@@ -69,8 +291,44 @@ class TalkBot:
         except Exception as e:
             log.error(f"[Monitor] Failed to retrieve messages for conversation {conversation_id}: {e}")
             return []
+
+    async def close(self) -> None:
+        if self.shards is not None:
+            await self.shards.stop()
+        # waits for the sink thread, so it must not hold up the event loop
+        await asyncio.to_thread(log.flush)
+        if self.metrics is not None:
+            await self.metrics.stop()
+        if self.webhook is not None:
+            await self.webhook.stop()
+        if self.preload is not None and not self.preload.done():
+            self.preload.cancel()
+        await self.ollama.pool.stop_health_checks()
+        await self.nc_bot.reactions.flush()
+        if self.state:
+            if self.state_flusher is not None:
+                self.state_flusher.cancel()
+            await self.state.close()
+        if self.response_cache is not None:
+            if self.cache_flusher is not None:
+                self.cache_flusher.cancel()
+            await self.response_cache.close()
+        await self.http.aclose()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self.request_shutdown)
+            except (NotImplementedError, RuntimeError):
+                # no signal handlers outside the main thread or on Windows; Ctrl+C still cancels the loop
+                pass
+        try:
+            await self.monitor_and_reply(self.check_interval)
+        finally:
+            await self.shutdown()
         
 
 if __name__ == "__main__":
     bot = TalkBot()
-    asyncio.run(bot.monitor_and_reply(bot.check_interval))
+    asyncio.run(bot.run())
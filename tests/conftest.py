@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for name, value in {
+    "NEXTCLOUD_URL": "http://nextcloud.test",
+    "NEXTCLOUD_USERNAME": "talkbot",
+    "NEXTCLOUD_PASSWORD": "secret",
+    "OLLAMA_HOST": "http://ollama.test",
+    "OLLAMA_MODEL": "test-model",
+    "OLLAMA_SYSTEM_PROMPT": "You are a test.",
+    "OLLAMA_ACTOR_ID": "talkbot",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+class _QuietTarget:
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+# modules grab the shared logger at import, so it is replaced before any of them is loaded
+import lib.log_sink  # noqa: E402
+
+lib.log_sink._logger = lib.log_sink.BotLogger(target=_QuietTarget(), level="CRITICAL", background=False)
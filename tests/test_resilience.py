@@ -0,0 +1,71 @@
+import asyncio
+
+import httpx
+import pytest
+
+from lib.resilience import CircuitBreaker, CircuitOpenError, Resilience
+import lib.resilience
+import lib.retry
+
+
+class NotFound(Exception):
+    status_code = 404
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    resilience = Resilience(rate=0, failure_threshold=1, cooldown=0)
+    monkeypatch.setattr(lib.resilience, "_resilience", resilience)
+    monkeypatch.setattr(lib.retry, "get_resilience", lambda: resilience)
+    monkeypatch.setattr(lib.retry, "_defaults", (1, 0.0, 1.0))
+    return resilience.breaker("nextcloud.messages")
+
+
+def call(raising, exceptions=(Exception,)):
+    @lib.retry.retry_async(exceptions=exceptions, endpoint="nextcloud.messages")
+    async def request():
+        if raising is not None:
+            raise raising
+        return "ok"
+    return asyncio.run(request())
+
+
+def open_breaker(breaker):
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_unlisted_transport_error_fails_the_probe(breaker):
+    open_breaker(breaker)
+    with pytest.raises(httpx.ConnectError):
+        call(httpx.ConnectError("refused"), exceptions=(ValueError,))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker._probing
+    assert call(None) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_error_closes_the_probe(breaker):
+    open_breaker(breaker)
+    with pytest.raises(NotFound):
+        call(NotFound())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_probe_is_released(breaker):
+    open_breaker(breaker)
+    with pytest.raises(asyncio.CancelledError):
+        call(asyncio.CancelledError())
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert call(None) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_only_one_probe_at_a_time():
+    breaker = CircuitBreaker("nextcloud", failure_threshold=1, cooldown=0)
+    breaker.record_failure()
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_error(httpx.ReadTimeout("slow"))
+    assert breaker.state == CircuitBreaker.OPEN
@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from lib.webhook_server import RANDOM_HEADER, SIGNATURE_HEADER, WebhookServer, sign_request
+
+SECRET = "webhook-secret"
+
+
+def message_event(token="room1", actor="users/alice"):
+    return json.dumps({
+        "type": "Create",
+        "actor": {"type": "Person", "id": actor},
+        "object": {"type": "Note", "name": "message", "content": "{\"message\":\"hi\"}"},
+        "target": {"type": "Collection", "id": token, "name": "Room"},
+    }).encode()
+
+
+def post(events):
+    # every (body, headers) pair is posted to a fresh server; returns the statuses and what was enqueued
+    async def run():
+        enqueued = []
+
+        async def on_message(token, event):
+            enqueued.append(token)
+
+        server = WebhookServer(SECRET, on_message, ignored_actors=("users/talkbot",))
+        async with TestClient(TestServer(server.app)) as client:
+            statuses = []
+            for body, headers in events:
+                response = await client.post(server.path, data=body, headers=headers)
+                statuses.append(response.status)
+        return statuses, enqueued
+    return asyncio.run(run())
+
+
+def test_signed_event_is_enqueued():
+    body = message_event()
+    assert post([(body, sign_request(SECRET, body))]) == ([200], ["room1"])
+
+
+def test_own_messages_are_ignored():
+    body = message_event(actor="users/talkbot")
+    assert post([(body, sign_request(SECRET, body))]) == ([200], [])
+
+
+def test_tampered_body_is_rejected():
+    headers = sign_request(SECRET, message_event())
+    assert post([(message_event(token="room2"), headers)]) == ([401], [])
+
+
+def test_wrong_secret_is_rejected():
+    body = message_event()
+    assert post([(body, sign_request("another-secret", body))]) == ([401], [])
+
+
+def test_unsigned_event_is_rejected():
+    body = message_event()
+    headers = sign_request(SECRET, body)
+    assert post([
+        (body, {}),
+        (body, {RANDOM_HEADER: headers[RANDOM_HEADER]}),
+        (body, {SIGNATURE_HEADER: headers[SIGNATURE_HEADER]}),
+    ]) == ([401, 401, 401], [])